@@ -1,9 +1,9 @@
 #!/usr/bin/python3
 
 import argparse
-from athos.log import get_logger, set_mininet_log_file
-from athos.athos import ATHOS
+import json
 import sys
+from athos.validator import DEFAULT_INPUT_FILE, validate_file, validate_json
 
 
 def parse_args(sys_args):
@@ -42,11 +42,153 @@ def parse_args(sys_args):
         help='Set the ping count used in pingall',
         default='1'
     )
+    args.add_argument(
+        '--concurrency',
+        action='store',
+        help='Set the maximum amount of pings running at once',
+        default='32'
+    )
+    args.add_argument(
+        '--ping-backend',
+        action='store',
+        choices=['ping', 'socket'],
+        help='Use the ping command or in-process raw sockets for pinging',
+        default='ping'
+    )
+    args.add_argument(
+        '--sample',
+        action='store_true',
+        help='Only pings a sample of pairs that covers every interface and '
+             'switch path, escalating to a full mesh around failures'
+    )
+    args.add_argument(
+        '--retry-budget',
+        action='store',
+        help='Maximum pairs that are re-probed in each sweep after losing '
+             'packets, 0 disables retries',
+        default='0'
+    )
+    args.add_argument(
+        '--retry-count',
+        action='store',
+        help='Number of pings sent when re-probing a pair',
+        default='5'
+    )
     args.add_argument(
         '-n', '--no-redundancy',
         action='store_true',
         help='Disables the link redundancy checker (Used for testing p4)'
     )
+    args.add_argument(
+        '--selective-retest',
+        action='store_true',
+        help='Only retests pairs that could use a link when it is changed, '
+             'followed by a final test over all pairs'
+    )
+    args.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only tests pairs involving members that changed since the last '
+             'successful run'
+    )
+    args.add_argument(
+        '--link-failures',
+        action='store',
+        help='Maximum number of core links set down together, combinations '
+             'that would partition a vlan or are equivalent to others are '
+             'skipped',
+        default='1'
+    )
+    args.add_argument(
+        '--switch-failures',
+        action='store_true',
+        help='Also tests each switch failing by setting all of its links down'
+    )
+    args.add_argument(
+        '-d', '--dual-stack',
+        action='store_true',
+        help='Tests IPv4 and IPv6 reachability at the same time'
+    )
+    args.add_argument(
+        '--prewarm',
+        action='store_true',
+        help='Installs neighbour entries and waits for IPv6 to be ready '
+             'before testing'
+    )
+    args.add_argument(
+        '--latency',
+        action='store_true',
+        help='Reports RTT percentiles for each phase and vlan, flags pairs '
+             'whose latency goes up after a link event and writes the RTTs '
+             'of every pair next to the log file'
+    )
+    args.add_argument(
+        '--reachability',
+        action='store_true',
+        help='Records which pairs could reach each other in each phase, '
+             'reports the pairs that broke compared to the baseline and writes '
+             'the matrices next to the log file'
+    )
+    args.add_argument(
+        '--convergence',
+        action='store_true',
+        help='Measures how long traffic is disrupted by each link event using '
+             'continuous pings across the change'
+    )
+    args.add_argument(
+        '--convergence-pairs',
+        action='store',
+        help='Maximum pairs of switches streamed across each link event',
+        default='4'
+    )
+    args.add_argument(
+        '--convergence-interval',
+        action='store',
+        help='Milliseconds between the pings of a convergence stream',
+        default='10'
+    )
+    args.add_argument(
+        '--validate-only',
+        action='store_true',
+        help='Only validates the topology file or JSON string and exits, '
+             'without loading mininet or writing any logs'
+    )
+    args.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Checks the expected reachability from the topology without '
+             'starting mininet'
+    )
+    args.add_argument(
+        '--cache-dir',
+        action='store',
+        help='Directory used to cache parsed topologies and the last run',
+        default='/var/cache/athos'
+    )
+    args.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always parses and validates the topology instead of using '
+             'the cache'
+    )
+    args.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Keeps the network up and serves requests on the control socket '
+             'instead of running a single test'
+    )
+    args.add_argument(
+        '--control-socket',
+        action='store',
+        help='Unix socket used by the daemon, /run/athos/athos.sock by default'
+    )
+    args.add_argument(
+        '--send',
+        action='store',
+        metavar='REQUEST',
+        help='Sends a request to a running daemon, either as a JSON object '
+             'or a command name, and prints the response'
+    )
     args.add_argument(
         '--thrift-port',
         action="store",
@@ -68,6 +210,29 @@ def parse_args(sys_args):
         action='store',
         help="Set location for log file",
     )
+    args.add_argument(
+        '--log-failed-only',
+        action='store_true',
+        help='Only logs the raw ping output of pairs that lost packets'
+    )
+    args.add_argument(
+        '--events',
+        action='store',
+        metavar='EVENTS_FILE',
+        help='Writes phases, pair results, link events and verdicts to a '
+             'file as newline delimited JSON while testing'
+    )
+    args.add_argument(
+        '--profile',
+        action='store_true',
+        help='Writes the time spent in each phase to a JSON file next to '
+             'the log file'
+    )
+    args.add_argument(
+        '--trace-events',
+        action='store_true',
+        help='Also writes the profile as a Chrome trace event file'
+    )
     args.add_argument(
         '-s','--script',
         action="store",
@@ -80,9 +245,56 @@ def parse_args(sys_args):
 def main():
 
     args = parse_args(sys.argv[1:])
+    if args.validate_only:
+        validate(args.topology_file, args.json_topology)
+    if args.send:
+        send(args.control_socket, args.send)
+    # Loaded here rather than at the top, as they pull in mininet
+    from athos.log import get_logger, set_mininet_log_file, \
+        start_queue_logging
+    from athos.athos import ATHOS
     logger = get_logger()
     set_mininet_log_file()
+    start_queue_logging()
     ATHOS().start(args, logger)
 
+
+def validate(input_file, json_topology=None):
+    """ Validates the topology file, or the JSON string when given, prints
+        any problems and exits """
+    if json_topology:
+        input_file = "JSON topology"
+        errors, warnings = validate_json(json_topology)
+    else:
+        input_file = input_file or DEFAULT_INPUT_FILE
+        errors, warnings = validate_file(input_file)
+    for msg in warnings:
+        print(f"Warning: {msg}")
+    for msg in errors:
+        print(f"Error: {msg}", file=sys.stderr)
+    if errors:
+        print(f"{len(errors)} errors found in {input_file}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{input_file} is valid")
+    sys.exit(0)
+
+
+def send(path, request):
+    """ Sends a request to the daemon, prints the response and exits """
+    from athos.daemon import DEFAULT_CONTROL_SOCKET, send_request
+    path = path or DEFAULT_CONTROL_SOCKET
+    try:
+        request = json.loads(request)
+    except ValueError:
+        request = {"cmd": request}
+    try:
+        response = send_request(path, request)
+    except (OSError, ValueError) as err:
+        print(f"Unable to reach the daemon on {path}: {err}", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(response, indent=1))
+    sys.exit(0 if response.get("ok") else 1)
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -6,26 +6,48 @@ Generates a mininet topology based on the info gathered from IXP Manager and the
 faucet config generator
 """
 
+import os
+import signal
 import sys
 import json
+import tempfile
 import time
 from datetime import datetime
-from subprocess import call
-from mininet.topo import Topo
-from mininet.net import Mininet
-from mininet.node import RemoteController
-from mininet.cli import CLI
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import call, PIPE, STDOUT
 from mininet.log import output, info, error, warn
-from athos.p4_mininet import P4Switch
+from athos.cache import TopologyCache, MODEL_FIELDS
+from athos.convergence import measure_outage
+from athos.daemon import ControlServer, DEFAULT_CONTROL_SOCKET
+from athos.dryrun import DryRun
+from athos.events import EventStream
+from athos.graph import SwitchGraph
+from athos.incremental import config_digest, diff_members, load_last_run, \
+    member_digests, port_key, store_last_run
+from athos.latency import RttStore, parse_rtts
+from athos.prober import IcmpProber, ProbeResult
+from athos.reachability import ReachabilityStore
+from athos.sampling import sample_pairs, uncovered_links
+from athos.scenarios import FailurePlanner
+from athos.timing import Profiler
+from athos.validator import ConfigValidator, DEFAULT_INPUT_FILE
 
 
-DEFAULT_INPUT_FILE = "/etc/athos/topology.json"
 DEFAULT_P4_COMPILER = "p4c"
 DEFAULT_P4_OPTIONS = "--target bmv2 --arch"
-DEFAULT_P4_SWITCH = "simple_switch"
-DEFAULT_UMBRELLA_JSON = "/etc/athos/umbrella.json"
 DEFAULT_LOG_FILE = "/var/log/athos/athos.log"
 DEFAULT_PLOSS_THRESHOLD = 5 # Threshold in % of packet loss before stopping test
+DEFAULT_PING_CONCURRENCY = 32 # Maximum amount of pings running at once
+DEFAULT_PING_BACKEND = "ping"
+DEFAULT_DAD_TIMEOUT = 5 # Seconds to wait for ipv6 duplicate address detection
+DEFAULT_CONVERGENCE_PAIRS = 4 # Pairs of switches streamed across each link
+DEFAULT_CONVERGENCE_INTERVAL = 10 # Milliseconds between convergence probes
+DEFAULT_RETRY_COUNT = 5 # Probes sent when retrying a pair that lost packets
+CONVERGENCE_WARMUP = 0.5 # Seconds streams run before the link is changed
+CONVERGENCE_HOLD = 2 # Seconds streams run after the link is changed
+# Attributes of the loaded config that a topology reload replaces
+RELOAD_STATE = ("member_digests", "hosts_matrix", "vlan_to_host_id",
+                "port_ids")
 
 LOGMSGFORMAT = '%(message)s'
 
@@ -46,22 +68,55 @@ class ATHOS():
         self.vlan_matrix = {}
         self.vlan_to_host_id = []
         self.p4_switches = []
+        self.links_down = {}
         self.logger = None
         self.unmanaged_switches = []
         self.ploss_threshold = DEFAULT_PLOSS_THRESHOLD
+        self.ping_concurrency = DEFAULT_PING_CONCURRENCY
+        self.ping_backend = DEFAULT_PING_BACKEND
+        self.icmp_prober = None
+        self.dual_stack = False
+        self.prewarm = False
+        self.graph = None
+        self.selective_retest = False
+        self.incremental = False
+        self.profiler = Profiler()
+        self.topology_cache = None
+        self.config_warnings = []
+        self.member_digests = {}
+        self.switch_digest = None
+        self.port_ids = {}
+        self.rtts = None
+        self.reachability = None
+        self.convergence = None
+        self.retry_budget = 0
+        self.retry_count = DEFAULT_RETRY_COUNT
+        self.sampled = False
+        self.samples = {}
+        self.max_link_failures = 1
+        self.switch_failures = False
+        self.events = None
+        self.log_failed_only = False
+        self.convergence_pairs = DEFAULT_CONVERGENCE_PAIRS
+        self.convergence_interval = DEFAULT_CONVERGENCE_INTERVAL / 1000
 
 
     def build_network(self, thrift_port_base=9190):
         """ Builds a mininet network based on the network matrix that's been
             given """
-
-        topo = self.MyTopo(hosts_matrix=self.hosts_matrix,
-                           switch_matrix=self.link_matrix,
-                           switch_dps=self.switch_dps,
-                           p4_switches=self.p4_switches,
-                           unmanaged_switches=self.unmanaged_switches,
-                           logger=self.logger,
-                           thrift_port_base=thrift_port_base)
+        # Mininet is only loaded once a network is built, so that checking a
+        # topology doesn't pay for importing it
+        from mininet.net import Mininet
+        from mininet.node import RemoteController
+        from athos.topo import MyTopo
+
+        topo = MyTopo(hosts_matrix=self.hosts_matrix,
+                      switch_matrix=self.link_matrix,
+                      switch_dps=self.switch_dps,
+                      p4_switches=self.p4_switches,
+                      unmanaged_switches=self.unmanaged_switches,
+                      logger=self.logger,
+                      thrift_port_base=thrift_port_base)
         self.net = Mininet(
             topo=topo,
             controller=RemoteController(
@@ -71,204 +126,954 @@ class ATHOS():
             ))
 
 
-    def test_network(self, no_redundancy=False, ping_count=1):
+    def test_network(self, no_redundancy=False, ping_count=1, members=None):
         """ Sets up the network and tests that all hosts can ping each other in
             ipv4 and ipv6. Also tests failover by disabling links between
-            switches """
-        v4_loss = self.ping_vlan_v4(ping_count)
-        # Compensates for ipv6 taking some time to set up
-        time.sleep(1)
-        v6_loss = self.ping_vlan_v6(ping_count)
+            switches. When members is given, only pairs involving those members
+            are tested. Returns whether the network passed """
+        base = None
+        if members is not None:
+            if not members:
+                info("*** No members have changed, nothing to test\n")
+                return True
+            base = self.member_pairs(members)
+        self.graph = self.build_graph()
+        self.begin_phase("baseline")
+        # Compensates for ipv6 taking some time to set up, unless we already
+        # waited for it while pre-warming
+        with self.profiler.phase("baseline"):
+            v4_loss, v6_loss = self.ping_all(ping_count,
+                                             settle=0 if self.prewarm else 1,
+                                             select=base)
         ploss_passed = self.packet_loss_threshold_passed(v4_loss, v6_loss)
         if not ploss_passed:
-            return
+            return False
         # No redundancy mode until p4 redundancy has been tested more
         if no_redundancy or self.p4_switches:
-            return
-        for link in (l for l in self.link_matrix if self.backup_exists(l)):
+            return True
+        self.report_bridges()
+        for link in (l for l in self.graph.links if self.backup_exists(l)):
             source_switch, destination_switch = link[0], link[2]
-            info(f"Setting link between {source_switch} and "
-                 f"{destination_switch} down\n")
-            self.net.configLinkStatus(source_switch, destination_switch, "down")
-            self.ping_vlan_v4(ping_count)
-            self.ping_vlan_v6(ping_count)
-            ploss_passed = self.packet_loss_threshold_passed(v4_loss, v6_loss,
-                                    source_switch, destination_switch, "down")
-            if not ploss_passed:
-                return
-            info(f"Setting link between {source_switch} and "
-                 f"{destination_switch} up\n")
-            self.net.configLinkStatus(source_switch, destination_switch, "up")
-            self.ping_vlan_v4(ping_count)
-            self.ping_vlan_v6(ping_count)
+            select = base
+            if self.selective_retest:
+                select = self.all_of(base, self.crossing_pairs(link))
+            try:
+                info(f"Setting link between {source_switch} and "
+                     f"{destination_switch} down\n")
+                self.begin_phase(f"{source_switch}-{destination_switch} down")
+                with self.profiler.phase("link down", src=source_switch,
+                                         dst=destination_switch):
+                    self.set_link_status(link, "down")
+                    v4_loss, v6_loss = self.ping_all(ping_count,
+                                                     select=select)
+                ploss_passed = self.packet_loss_threshold_passed(
+                    v4_loss, v6_loss, source_switch, destination_switch,
+                    "down")
+                if not ploss_passed:
+                    return False
+                info(f"Setting link between {source_switch} and "
+                     f"{destination_switch} up\n")
+                self.begin_phase(f"{source_switch}-{destination_switch} up")
+                with self.profiler.phase("link up", src=source_switch,
+                                         dst=destination_switch):
+                    self.set_link_status(link, "up")
+                    v4_loss, v6_loss = self.ping_all(ping_count,
+                                                     select=select)
+            finally:
+                # The network stays up when serving requests, so a link
+                # left down would fail every later test
+                self.restore_links([link])
             ploss_passed = self.packet_loss_threshold_passed(v4_loss, v6_loss,
                                     source_switch, destination_switch, "up")
             if not ploss_passed:
-                return
+                return False
+        for scenario in self.failure_scenarios():
+            if not self.test_scenario(scenario, base, ping_count):
+                return False
+        if self.selective_retest:
+            info("*** Running final sanity check over all pairs\n")
+            self.begin_phase("sanity check")
+            with self.profiler.phase("sanity check"):
+                v4_loss, v6_loss = self.ping_all(ping_count, select=base)
+            return self.packet_loss_threshold_passed(v4_loss, v6_loss,
+                status="after all links were set back up")
+        return True
+
+
+    def failure_scenarios(self):
+        """ Plans the scenarios where several links, or a whole switch, go
+            down at once """
+        if self.max_link_failures < 2 and not self.switch_failures:
+            return []
+        planner = FailurePlanner(self.graph, self.vlan_switches())
+        scenarios = []
+        if self.max_link_failures > 1:
+            scenarios += planner.link_scenarios(self.max_link_failures)
+        if self.switch_failures:
+            scenarios += planner.switch_scenarios(self.switch_dps or [])
+        info(f"*** Testing {len(scenarios)} failure scenarios out of "
+             f"{planner.considered}, {planner.pruned['partition']} would "
+             f"partition a vlan, {planner.pruned['superset']} contain a "
+             f"partition and {planner.pruned['equivalent']} are equivalent to "
+             "others\n")
+        return scenarios
+
+
+    def test_scenario(self, scenario, base=None, ping_count=1):
+        """ Sets the links of the scenario down and back up, testing the
+            pairs after each change. Pairs with a member on a failed switch
+            are left out. Returns whether the network passed """
+        select = base
+        if scenario.switch:
+            switch = scenario.switch
+            select = self.all_of(base, lambda vlan, host, dst:
+                                 switch not in (host["switch"], dst["switch"]))
+        if self.selective_retest:
+            select = self.all_of(select, self.any_of(
+                *(self.crossing_pairs(link) for link in scenario.links)))
+        try:
+            for status in ("down", "up"):
+                info(f"Setting {scenario.name} {status}\n")
+                self.begin_phase(f"{scenario.name} {status}")
+                with self.profiler.phase(f"scenario {status}",
+                                         scenario=scenario.name):
+                    for link in scenario.links:
+                        self.set_link_status(link, status)
+                    v4_loss, v6_loss = self.ping_all(ping_count,
+                                                     select=select)
+                if not self.packet_loss_threshold_passed(
+                        v4_loss, v6_loss,
+                        status=f"when {scenario.name} were set {status}"):
+                    return False
+        finally:
+            # Brings back every link of the scenario, including when one of
+            # them failed to change, before any failure is raised
+            self.restore_links(scenario.links)
+        return True
+
+
+    def crossing_pairs(self, link):
+        """ Returns a filter that selects the pairs whose traffic could have
+            crossed the link, based on the switches the hosts are attached to """
+        switches = set().union(*self.vlan_switches().values())
+        crossing = self.graph.crossing_pairs(link[0], link[2], switches)
+        info(f"{len(crossing)} pairs of member switches could use the link "
+             f"between {link[0]} and {link[2]}\n")
+        return lambda vlan, host, dst: \
+            self.graph.edge(host["switch"], dst["switch"]) in crossing
+
+
+    def set_link_status(self, link, status):
+        """ Sets the links between two switches up or down, measuring how
+            long traffic is disrupted when in convergence mode """
+        self.emit("link", src=link[0], dst=link[2], status=status)
+        if status == "down":
+            self.links_down[(link[0], link[2])] = link
+        if self.convergence is None:
+            self.net.configLinkStatus(link[0], link[2], status)
+        else:
+            self.measure_convergence(link, status)
+        if status == "up":
+            self.links_down.pop((link[0], link[2]), None)
+
+
+    def restore_links(self, links):
+        """ Sets any of the links that were left down back up, without
+            measuring or testing anything. Every link is tried before the
+            first failure is raised """
+        failure = None
+        for link in links:
+            if (link[0], link[2]) not in self.links_down:
+                continue
+            info(f"Restoring link between {link[0]} and {link[2]}\n")
+            try:
+                self.net.configLinkStatus(link[0], link[2], "up")
+            except Exception as err:
+                error(f"Unable to restore the link between {link[0]} and "
+                      f"{link[2]}: {err}\n")
+                failure = failure or err
+                continue
+            self.emit("link", src=link[0], dst=link[2], status="up")
+            del self.links_down[(link[0], link[2])]
+        if failure:
+            raise failure
+
+
+    def measure_convergence(self, link, status):
+        """ Sets the link status while streams of pings run in both
+            directions between hosts whose traffic could use the link, and
+            reports how long each direction was disrupted for """
+        event = f"{link[0]}-{link[2]} {status}"
+        pairs = self.stream_pairs(link)
+        if not pairs:
+            info(f"*** Convergence {event}: no member pairs could use the "
+                 "link\n")
+        streams = [(pair, self.start_stream(*pair)) for pair in pairs]
+        time.sleep(CONVERGENCE_WARMUP)
+        event_time = time.time()
+        self.net.configLinkStatus(link[0], link[2], status)
+        time.sleep(CONVERGENCE_HOLD)
+        for (vlan, family, host, dst), proc in streams:
+            proc.send_signal(signal.SIGINT)
+            result, _ = proc.communicate()
+            self.logger.debug(result)
+            outage = measure_outage(result, event_time,
+                                    self.convergence_interval)
+            outage.update(event=event, vlan=str(vlan), family=family,
+                          src=host["name"], src_host=f"h{host['id']}",
+                          dst=dst["name"], dst_host=f"h{dst['id']}")
+            self.convergence.append(outage)
+            if not outage["recovered"]:
+                msg = (f"not recovered after {CONVERGENCE_HOLD}s "
+                       f"({outage['lost']} lost)")
+            elif outage["outage_ms"] is None:
+                msg = "no loss"
+            else:
+                msg = (f"outage {outage['outage_ms']}ms "
+                       f"({outage['lost']} lost)")
+            info(f"*** Convergence {event}: {host['name']} -> {dst['name']} "
+                 f"{family} vlan {vlan}: {msg}\n")
+
+
+    def stream_pairs(self, link):
+        """ Picks a pair of hosts for up to convergence_pairs pairs of
+            switches whose traffic could cross the link. Each pair is listed
+            in both directions as (vlan, family, host, dst) """
+        switches = set().union(*self.vlan_switches().values())
+        crossing = sorted(sorted(edge) for edge in self.graph.crossing_pairs(
+            link[0], link[2], switches))
+        pairs = []
+        for vlan, members in self.vlan_matrix.items():
+            by_switch = {}
+            for host in members:
+                by_switch.setdefault(host["switch"], []).append(host)
+            for src_switch, dst_switch in list(crossing):
+                for family in ("ipv4", "ipv6"):
+                    srcs = [host for host in by_switch.get(src_switch, [])
+                            if family in host]
+                    dsts = [dst for dst in by_switch.get(dst_switch, [])
+                            if family in dst]
+                    if srcs and dsts:
+                        pairs.append((vlan, family, srcs[0], dsts[0]))
+                        pairs.append((vlan, family, dsts[0], srcs[0]))
+                        crossing.remove([src_switch, dst_switch])
+                        break
+                if len(pairs) >= 2 * self.convergence_pairs:
+                    return pairs
+        return pairs
+
+
+    def start_stream(self, vlan, family, host, dst):
+        """ Starts a continuous timestamped ping from the host to dst """
+        host_node = self.net.getNodeByName(f"h{host['id']}")
+        ping = "ping" if family == "ipv4" else "ping6"
+        return host_node.popen([ping, '-D', '-O', '-n', '-I', host["port"],
+                                '-i', str(self.convergence_interval),
+                                '-W', '1', dst[family].split('/')[0]],
+                               stdout=PIPE, stderr=STDOUT,
+                               universal_newlines=True)
+
+
+    def report_convergence(self, log_dir):
+        """ Reports the longest outage of each link event and writes the
+            outage of every stream to the log directory """
+        worst = {}
+        for outage in self.convergence:
+            longest = worst.setdefault(outage["event"], outage)
+            if not outage["recovered"] or \
+               (outage["outage_ms"] or 0) > (longest["outage_ms"] or 0):
+                worst[outage["event"]] = outage
+        for event, outage in worst.items():
+            if not outage["recovered"]:
+                error(f"FAIL: Traffic from {outage['src']} to {outage['dst']} "
+                      f"did not recover within {CONVERGENCE_HOLD}s of {event}\n")
+            elif outage["outage_ms"] is None:
+                info(f"*** No outage during {event}\n")
+            else:
+                info(f"*** Longest outage {event}: {outage['outage_ms']}ms "
+                     f"from {outage['src']} to {outage['dst']}\n")
+        stamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        path = os.path.join(log_dir, f"athos_convergence_{stamp}.json")
+        with open(path, "w") as report_file:
+            json.dump(self.convergence, report_file, indent=1)
+        info(f"Convergence report written to {path}\n")
+
+
+    def begin_phase(self, phase):
+        """ Records the following RTT samples and reachability as part of the
+            phase """
+        if self.rtts:
+            self.rtts.begin(phase)
+        if self.reachability:
+            self.reachability.begin(phase)
+
+
+    def report_latency(self, log_dir):
+        """ Reports the RTT percentiles of each phase and vlan, flags the
+            pairs whose latency went up after a link event and writes the
+            percentiles of every pair to the log directory """
+        for phase in self.rtts.phases:
+            summary = self.rtts.summary(phase)
+            info(f"*** RTT {phase}: {self.format_percentiles(summary['all'])}"
+                 "\n")
+            for vlan, pct in sorted(summary["vlans"].items()):
+                info(f"    {vlan}: {self.format_percentiles(pct)}\n")
+        for phase, pair, before, after in self.rtts.regressions():
+            warn(f"Latency regression {phase}: {pair['src']} "
+                 f"({pair['src_host']}) -> {pair['dst']} ({pair['dst_host']}) "
+                 f"{pair['family']} vlan {pair['vlan']} median went from "
+                 f"{before}ms to {after}ms\n")
+        stamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        path = os.path.join(log_dir, f"athos_rtt_{stamp}.json")
+        self.rtts.to_json(path)
+        info(f"RTT report written to {path}\n")
+
+
+    def report_reachability(self, log_dir):
+        """ Reports the pairs that broke in each phase compared to the
+            baseline, and writes the reachability matrices of every phase to
+            the log directory """
+        names = {iface["id"]: f"{iface['name']} (h{iface['id']})"
+                 for iface in self.hosts_matrix + self.vlan_to_host_id}
+        for phase in self.reachability.phases:
+            if phase == "baseline":
+                continue
+            changes = self.reachability.diff("baseline", phase)
+            for key, (broken, _) in sorted(changes.items()):
+                if not broken:
+                    continue
+                warn(f"{len(broken)} {key} pairs that worked in the baseline "
+                     f"broke during {phase}\n")
+                for src, dst in broken:
+                    info(f"    {names.get(src, src)} -> {names.get(dst, dst)}"
+                         "\n")
+        stamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        path = os.path.join(log_dir, f"athos_reachability_{stamp}.json")
+        self.reachability.to_json(path)
+        info(f"Reachability matrices written to {path}\n")
+
+
+    @staticmethod
+    def format_percentiles(pct):
+        """ Formats percentiles for the log """
+        return (f"p50 {pct['p50']}ms p95 {pct['p95']}ms p99 {pct['p99']}ms "
+                f"({pct['count']} samples)")
+
+
+    @staticmethod
+    def member_pairs(members):
+        """ Returns a filter that selects the pairs involving the members """
+        return lambda vlan, host, dst: \
+            host["name"] in members or dst["name"] in members
+
+
+    @staticmethod
+    def any_of(*selects):
+        """ Combines pair filters, selecting the pairs any of them accept """
+        return lambda vlan, host, dst: \
+            any(select(vlan, host, dst) for select in selects)
+
+
+    @staticmethod
+    def all_of(*selects):
+        """ Combines pair filters, ignoring those that aren't set """
+        selects = [select for select in selects if select]
+        if not selects:
+            return None
+        if len(selects) == 1:
+            return selects[0]
+        return lambda vlan, host, dst: \
+            all(select(vlan, host, dst) for select in selects)
+
+
+    def reload_topology(self, nw_matrix):
+        """ Applies a new topology to the running network, only rebuilding
+            the hosts of members that were added, removed or changed. Returns
+            the differences, or None if the topology couldn't be applied and
+            the network was left as it was """
+        if not self.check_config(nw_matrix):
+            return None
+        if config_digest(nw_matrix["switch_matrix"]) != self.switch_digest:
+            error("The switches have changed, the network needs to be "
+                  "rebuilt\n")
+            return None
+        old_state = {attr: getattr(self, attr) for attr in RELOAD_STATE}
+        self.load_config(nw_matrix)
+        diff = diff_members(old_state["member_digests"], self.member_digests)
+        removed = {}
+        for iface in old_state["hosts_matrix"]:
+            if iface["name"] in diff.removed | diff.changed:
+                removed.setdefault(f"h{iface['id']}", iface)
+        added = {}
+        for iface in self.hosts_matrix:
+            if iface["name"] in diff.affected:
+                added.setdefault(f"h{iface['id']}", iface)
+        p4_members = sorted({iface["name"] for iface in
+                             list(removed.values()) + list(added.values())
+                             if iface["switch"] in self.p4_switches})
+        if p4_members:
+            error("Hosts can't be attached to or detached from running P4 "
+                  "switches, the network needs to be rebuilt to apply the "
+                  f"changes to {', '.join(p4_members)}\n")
+            for attr, value in old_state.items():
+                setattr(self, attr, value)
+            return None
+        info(f"*** Reloading topology: {len(diff.added)} members added, "
+             f"{len(diff.removed)} removed and {len(diff.changed)} changed\n")
+        detached = []
+        attached = []
+        try:
+            for hname in sorted(removed):
+                detached.append(hname)
+                self.remove_host(hname)
+            for hname, iface in added.items():
+                attached.append(hname)
+                self.add_host(iface)
+        except Exception as err:
+            error(f"Reloading the topology failed: {err}\n")
+            self.restore_hosts(old_state, attached,
+                               [removed[hname] for hname in detached])
+            return None
+        batches = self.ip_config_batches()
+        self.run_ip_batches({hname: batch for hname, batch in batches.items()
+                             if hname in added})
+        if self.prewarm and diff:
+            self.prewarm_neighbours()
+        return diff
+
+
+    def restore_hosts(self, state, added, removed):
+        """ Puts the network back the way it was before a reload that failed
+            partway through, removing the hosts that were added and adding
+            back the flattened interfaces that were removed """
+        info("*** Restoring the previous topology\n")
+        for attr, value in state.items():
+            setattr(self, attr, value)
+        try:
+            for hname in added:
+                if hname in self.net:
+                    self.remove_host(hname)
+            restored = set()
+            for iface in removed:
+                hname = f"h{iface['id']}"
+                if hname in self.net:
+                    self.remove_host(hname)
+                self.add_host(iface)
+                restored.add(hname)
+            batches = self.ip_config_batches()
+            self.run_ip_batches({hname: batch
+                                 for hname, batch in batches.items()
+                                 if hname in restored})
+        except Exception:
+            error("Unable to restore the previous topology, the network "
+                  "needs to be rebuilt\n")
+            raise
+
+
+    def remove_host(self, hname):
+        """ Removes a host and its links from the running network """
+        node = self.net.getNodeByName(hname)
+        if self.icmp_prober:
+            self.icmp_prober.forget(node.pid)
+        for intf in node.intfList():
+            link = intf.link
+            if not link:
+                continue
+            other = link.intf1 if link.intf2 is intf else link.intf2
+            if hasattr(other.node, "detach"):
+                other.node.detach(other)
+            self.net.delLink(link)
+        self.net.delHost(node)
+
+
+    def add_host(self, iface):
+        """ Adds the host for a flattened interface to the running network
+            and attaches it to its switch """
+        from athos.topo import MyTopo
+        hname, params = MyTopo.host_params(iface)
+        host = self.net.addHost(hname, **params)
+        switch = self.net.getNodeByName(iface["switch"])
+        link = self.net.addLink(switch, host, iface["swport"])
+        if hasattr(switch, "attach"):
+            switch.attach(link.intf1)
+        host.configDefault()
 
 
     def cleanup_ips(self):
         """ Cleans up ip addresses, in particular hosts with multiple interfaces
-            and vlans """
-        self.vlan_matrix["none"] = []
+            and vlans. The ip commands for each host are run as a single batch,
+            with all hosts being configured in parallel """
+        self.run_ip_batches(self.ip_config_batches())
+
+
+    def ip_config_batches(self):
+        """ Builds the vlan matrix along with the ip commands needed to
+            configure each host's interfaces, grouped per host """
+        batches = {}
+        self.vlan_matrix = {"none": []}
+        self.samples = {}
         for iface in self.hosts_matrix:
+            batch = batches.setdefault(f"h{iface['id']}", [])
             host = {"name": iface["name"]}
             host["port"] = f"h{iface['id']}-eth0"
             host["id"] = iface["id"]
+            host["mac"] = iface["mac"]
+            host["switch"] = iface["switch"]
             if "ipv4" in iface:
                 host["ipv4"] = iface["ipv4"]
             if "ipv6" in iface:
                 host["ipv6"] = iface["ipv6"]
-                self.add_ipv6(iface['id'], f"h{iface['id']}-eth0", iface)
+                self.add_ipv6(batch, f"h{iface['id']}-eth0", iface)
             if "vlan" not in iface:
                 self.vlan_matrix["none"].append(host)
         for iface in self.vlan_to_host_id:
-            host = {"name": iface["name"]}
-            host["port"] = "eth-0"
-            if "ipv4" in iface:
-                host["ipv4"] = iface["ipv4"]
-            if "ipv6" in iface:
-                host["ipv6"] = iface["ipv6"]
-            hnode = self.net.getNodeByName(f"h{iface['id']}")
+            hname = f"h{iface['id']}"
+            batch = batches.setdefault(hname, [])
+            hnode = self.net.getNodeByName(hname)
             if hnode.IP() == "127.0.0.1":
-                hnode.cmd(f"ip addr del dev h{iface['id']}-eth0 127.0.0.1")
-                hnode.cmd(f"ip -6 addr flush dev h{iface['id']}-eth0")
-            hnode.cmd(f"ip link set dev h{iface['id']}-eth0 {iface['mac']}")
-            self.add_vlan(iface["id"], iface, 0)
+                batch.append(f"addr del dev {hname}-eth0 127.0.0.1/32")
+                batch.append(f"addr flush dev {hname}-eth0 to ::/0")
+            batch.append(f"link set dev {hname}-eth0 address {iface['mac']}")
+            self.add_vlan(batch, iface["id"], iface, 0)
+        return batches
 
 
-    def add_vlan(self, hostname, iface, port):
-        """ Adds a vlan address to the specified port """
+    def add_vlan(self, batch, hostname, iface, port):
+        """ Adds the commands that set up a vlan address on the specified port
+            to the host's batch """
         self.vlan_matrix.setdefault(iface["vlan"], [])
-        host_node = self.net.getNodeByName(f"h{hostname}")
         phase = f"h{hostname}-eth{port}"
         vid = iface["vlan"]
         vlan_port_name = f"eth{port}.{vid}" if iface['tagged'] else f'h{iface["id"]}-eth0'
         host = {"name": iface["name"]}
         host["port"] = vlan_port_name
         host["id"] = iface["id"]
+        host["mac"] = iface["mac"]
+        host["switch"] = iface["switch"]
         if iface["tagged"]:
-            host_node.cmd(f'ip link add link {phase} name ' +
-                        f'{vlan_port_name} type vlan id {vid}')
+            batch.append(f"link add link {phase} name {vlan_port_name} "
+                         f"type vlan id {vid}")
         if "ipv4" in iface:
-            host_node.cmd(f"ip addr add dev {vlan_port_name} {iface['ipv4']}")
+            batch.append(f"addr add dev {vlan_port_name} {iface['ipv4']}")
             host["ipv4"] = iface["ipv4"]
         if "ipv6" in iface:
-            self.add_ipv6(hostname, vlan_port_name, iface)
+            self.add_ipv6(batch, vlan_port_name, iface)
             host["ipv6"] = iface["ipv6"]
         if iface["tagged"]:
-            host_node.cmd(f"ip link set dev {vlan_port_name} up")
-            host_node.cmd(f"ip link set address {iface['mac']} dev {vlan_port_name}")
+            batch.append(f"link set dev {vlan_port_name} up")
+            batch.append(f"link set address {iface['mac']} dev {vlan_port_name}")
         self.vlan_matrix[iface["vlan"]].append(host)
 
 
-    def add_ipv6(self, hostname, portname, iface):
-        """ Removes the default ipv6 address from hosts and adds the ip based on
-            the hosts matrix """
-        host_node = self.net.getNodeByName(f"h{hostname}")
-        host_node.cmd(f"ip -6 addr flush dev {portname}")
-        host_node.cmd(f"ip -6 addr add dev {portname} {iface['ipv6']}")
+    def prewarm_neighbours(self):
+        """ Installs permanent neighbour entries between all hosts within the
+            same vlan and waits for ipv6 duplicate address detection to finish.
+            This prevents the first ping of each pair being lost to address
+            resolution """
+        info("*** Pre-warming neighbour tables\n")
+        batches = {}
+        for members in self.vlan_matrix.values():
+            for host in members:
+                batch = batches.setdefault(f"h{host['id']}", [])
+                for dst in members:
+                    if dst is host:
+                        continue
+                    for family in ("ipv4", "ipv6"):
+                        if family not in host or family not in dst:
+                            continue
+                        addr = dst[family].split('/')[0]
+                        batch.append(f"neigh replace {addr} lladdr "
+                                     f"{dst['mac']} dev {host['port']} "
+                                     "nud permanent")
+        self.run_ip_batches(batches)
+        self.wait_for_dad()
+
+
+    def wait_for_dad(self, timeout=DEFAULT_DAD_TIMEOUT):
+        """ Waits until none of the hosts have tentative ipv6 addresses left """
+        pending = sorted({f"h{host['id']}"
+                          for members in self.vlan_matrix.values()
+                          for host in members if "ipv6" in host})
+        deadline = time.monotonic() + timeout
+        workers = max(1, min(self.ping_concurrency, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending:
+                tentative = pool.map(self.tentative_addresses, pending)
+                pending = [hname for hname, addrs in zip(pending, tentative)
+                           if addrs]
+                if not pending:
+                    break
+                if time.monotonic() > deadline:
+                    warn("Duplicate address detection has not finished on: "
+                         f"{' '.join(pending)}\n")
+                    break
+                time.sleep(0.1)
+
+
+    def tentative_addresses(self, hname):
+        """ Lists the host's ipv6 addresses that are still tentative """
+        with self.profiler.command(hname, "ip -6 addr show tentative"):
+            return self.net.getNodeByName(hname).cmd(
+                "ip -6 addr show tentative").strip()
+
+
+    def run_ip_batches(self, batches):
+        """ Runs the ip commands (without the leading 'ip') for each host as a
+            single batch, with the batches for all hosts running in parallel.
+            The commands are passed through a file as a long command line won't
+            fit through the host's shell """
+        def run_batch(item):
+            hname, cmds = item
+            if not cmds:
+                return
+            with tempfile.NamedTemporaryFile("w", prefix=f"athos-{hname}-",
+                                             suffix=".batch") as batch, \
+                 self.profiler.command(hname, "ip batch"):
+                batch.write("\n".join(cmds) + "\n")
+                batch.flush()
+                result = self.net.getNodeByName(hname).cmd(
+                    f"ip -force -batch {batch.name}")
+            if result.strip():
+                self.logger.debug(result)
 
-    def ping_vlan_v4(self, ping_count=1):
-        """ Uses the hosts matrix and pings all the ipv6 addresses, similar to
+        workers = max(1, min(self.ping_concurrency, len(batches)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run_batch, batches.items()))
+
+
+    @staticmethod
+    def add_ipv6(batch, portname, iface):
+        """ Adds the commands that remove the default ipv6 address from the
+            port and add the ip based on the hosts matrix to the host's batch.
+            Flushing with a ::/0 prefix leaves the ipv4 addresses in place """
+        batch.append(f"addr flush dev {portname} to ::/0")
+        batch.append(f"addr add dev {portname} {iface['ipv6']}")
+
+
+    def ping_all(self, ping_count=1, settle=0, select=None):
+        """ Tests ipv4 and ipv6 reachability, returning the packet loss of
+            each. In dual stack mode both address families are probed at the
+            same time, otherwise ipv6 is tested after ipv4 has finished.
+            settle is the time in seconds given for ipv6 to set up, and select
+            optionally limits the sweeps to the pairs it accepts """
+        if not self.dual_stack:
+            v4_loss = self.ping_vlan_v4(ping_count, select)
+            time.sleep(settle)
+            return v4_loss, self.ping_vlan_v6(ping_count, select)
+        time.sleep(settle)
+        probe_vlan = self.profiler.inherit(self.probe_vlan)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            v4_sweep = pool.submit(probe_vlan, "ipv4", ping_count, select)
+            v6_sweep = pool.submit(probe_vlan, "ipv6", ping_count, select)
+            info('*** Ping: testing ping4 reachability\n')
+            v4_loss = self.report_vlan(*v4_sweep.result(), "ipv4")
+            info('*** Ping: testing ping6 reachability\n')
+            v6_loss = self.report_vlan(*v6_sweep.result(), "ipv6")
+        return v4_loss, v6_loss
+
+
+    def ping_vlan_v4(self, ping_count=1, select=None):
+        """ Uses the hosts matrix and pings all the ipv4 addresses, similar to
             mininet's pingall format """
         info('*** Ping: testing ping4 reachability\n')
-        packets = 0
-        lost = 0
-        ploss = None
-        for vlan in self.vlan_matrix:
-            info(f"Testing reachability for hosts with vlan: {vlan}\n")
-            for host in self.vlan_matrix[vlan]:
-                results = []
-                if "ipv4" not in host:
-                    continue
-                host_node = self.net.getNodeByName(f"h{host['id']}")
-                output(f'{host["name"]} -> ')
-                for dst in self.vlan_matrix[vlan]:
-                    if dst is host:
-                        continue
-                    if "ipv4" not in dst:
-                        continue
-                    addr = dst['ipv4'].split('/')[0]
-                    result = host_node.cmd(f'ping -I {host["port"]}' +
-                                           f' -c{ping_count}  -W 1 -i 0.01 {addr}')
-                    self.logger.debug(result)
-                    sent, received = self.net._parsePing(result)
-                    packets += sent
-                    lost += sent - received
-                    out = 'X'
-                    if received:
-                        out = dst["name"]
-                    output(f'{out} ')
-                    results.append(out)
-                output('\n')
-        if packets > 0:
-            ploss = 100.0 * lost / packets
-            received = packets - lost
-            info(f"*** Results: {round(ploss, 2)}% dropped "
-                 f"({received}/{packets} received)\n")
-            return ploss
+        return self.ping_vlan("ipv4", ping_count, select)
 
 
-    def ping_vlan_v6(self, ping_count=1):
+    def ping_vlan_v6(self, ping_count=1, select=None):
         """ Uses the hosts matrix and pings all the ipv6 addresses, similar to
             mininet's pingall format """
         info('*** Ping: testing ping6 reachability\n')
+        return self.ping_vlan("ipv6", ping_count, select)
+
+
+    def ping_vlan(self, family, ping_count=1, select=None):
+        """ Pings between all hosts within the same vlan for the given address
+            family. The pings are run concurrently, while the results are
+            reported in the same order as mininet's pingall format """
+        return self.report_vlan(*self.probe_vlan(family, ping_count, select),
+                                family)
+
+
+    def probe_vlan(self, family, ping_count=1, select=None):
+        """ Probes all pairs within the same vlan for the given address family
+            without reporting. Returns the sweep plan and the results """
+        sample = self.sample_plan(family) if self.sampled else None
+        plan = self.sweep_plan(family, select, sample)
+        pairs = [(host, dst) for _, sources in plan
+                 for host, dsts in sources for dst in dsts]
+        with self.profiler.phase(f"sweep {family}", pairs=len(pairs)):
+            results = self.run_probes(pairs, family, ping_count)
+            if self.retry_budget:
+                results = self.retry_failed(pairs, results, family)
+            if sample:
+                plan, results = self.escalate(family, select, sample, plan,
+                                              results, ping_count)
+        if self.rtts:
+            sweep = ((vlan, host, dst) for vlan, sources in plan
+                     for host, dsts in sources for dst in dsts)
+            for (vlan, host, dst), result in zip(sweep, results):
+                self.rtts.record(family, vlan, host, dst, result.rtts)
+        if self.reachability:
+            self.reachability.record(family, plan, results, {
+                vlan: [host["id"] for host in members if family in host]
+                for vlan, members in self.vlan_matrix.items()})
+        return plan, results
+
+
+    def sample_plan(self, family):
+        """ Picks the ids of the sampled destinations of each source for the
+            address family, keyed by the vlan and the id of the source. The
+            ids are those given to each interface when the topology is
+            flattened, so the sample still applies when the vlan matrix is
+            rebuilt. The sample is worked out once for each family, and logs
+            any link that it doesn't cover """
+        if family not in self.samples:
+            sample = {}
+            switch_pairs = set()
+            for vlan, members in self.vlan_matrix.items():
+                members = [host for host in members if family in host]
+                for src, dst in sample_pairs(members):
+                    sample.setdefault((vlan, members[src]["id"]), []).append(
+                        members[dst]["id"])
+                    switch_pairs.add((members[src]["switch"],
+                                      members[dst]["switch"]))
+            info(f"*** Sampling {sum(map(len, sample.values()))} {family} "
+                 "pairs\n")
+            if self.graph:
+                for link in uncovered_links(self.graph, switch_pairs):
+                    info(f"No {family} pairs could use the link between "
+                         f"{link[0]} and {link[2]}\n")
+            self.samples[family] = sample
+        return self.samples[family]
+
+
+    def escalate(self, family, select, sample, plan, results, ping_count=1):
+        """ Probes every pair involving the interfaces that failed within
+            a sampled sweep, that wasn't already part of the sample. Returns
+            the plan and results with the extra pairs added """
+        sweep = ((vlan, host, dst) for vlan, sources in plan
+                 for host, dsts in sources for dst in dsts)
+        failed = set()
+        for (vlan, host, dst), result in zip(sweep, results):
+            if result.received < result.sent and not result.transient:
+                failed.update(((vlan, host["id"]), (vlan, dst["id"])))
+        if not failed:
+            return plan, results
+        info(f"*** Escalating to a full mesh around {len(failed)} {family} "
+             "interfaces with failures\n")
+        around = lambda vlan, host, dst: \
+            ((vlan, host["id"]) in failed or (vlan, dst["id"]) in failed) and \
+            dst["id"] not in sample.get((vlan, host["id"]), ())
+        extra = self.sweep_plan(family, self.all_of(select, around))
+        pairs = [(host, dst) for _, sources in extra
+                 for host, dsts in sources for dst in dsts]
+        extra_results = self.run_probes(pairs, family, ping_count)
+        if self.retry_budget:
+            extra_results = self.retry_failed(pairs, extra_results, family)
+        return plan + extra, list(results) + extra_results
+
+
+    def retry_failed(self, pairs, results, family):
+        """ Re-probes the pairs that lost packets with retry_count probes
+            each, for up to retry_budget pairs. The results of the pairs
+            retried keep their original counts, with transient set to whether
+            every reply came back on the retry. Only the persistent failures
+            count towards the packet loss """
+        failed = [i for i, result in enumerate(results)
+                  if result.received < result.sent]
+        if not failed:
+            return results
+        retried = failed[:self.retry_budget]
+        retries = self.run_probes([pairs[i] for i in retried], family,
+                                  self.retry_count)
+        results = list(results)
+        persistent = []
+        for i, retry in zip(retried, retries):
+            transient = retry.received == retry.sent
+            results[i] = results[i]._replace(transient=transient)
+            if not transient:
+                persistent.append(pairs[i])
+        info(f"*** Retried {len(retried)} {family} pairs that lost packets: "
+             f"{len(retried) - len(persistent)} transient and "
+             f"{len(persistent)} persistent failures\n")
+        for host, dst in persistent:
+            warn(f"Persistent {family} failure: {host['name']} "
+                 f"(h{host['id']}) -> {dst['name']} (h{dst['id']})\n")
+        if len(failed) > len(retried):
+            warn(f"Retry budget exhausted, {len(failed) - len(retried)} "
+                 f"{family} pairs that lost packets were not retried\n")
+        return results
+
+
+    def emit(self, event, **fields):
+        """ Sends an event to the event stream, if there is one """
+        if self.events:
+            self.events.emit(event, **fields)
+
+
+    def report_vlan(self, plan, results, family=None):
+        """ Reports the results of a sweep in mininet's pingall format and
+            returns the packet loss. Each pair is also sent to the event
+            stream. Pairs that only lost packets transiently, getting every
+            reply when retried, are reported but left out of the packet loss
+            the threshold is checked against """
+        results = iter(results)
         packets = 0
+        received = 0
         lost = 0
+        transient = 0
         ploss = None
-        for vlan in self.vlan_matrix:
+        for vlan, sources in plan:
             info(f"Testing reachability for hosts with vlan: {vlan}\n")
-            for host in self.vlan_matrix[vlan]:
-                if "ipv6" not in host:
-                    continue
-                host_node = self.net.getNodeByName(f"h{host['id']}")
+            for host, dsts in sources:
                 output(f'{host["name"]} -> ')
-                for dst in self.vlan_matrix[vlan]:
-                    if dst is host:
-                        continue
-                    if "ipv6" not in dst:
-                        continue
-                    addr = dst['ipv6'].split('/')[0]
-                    result = host_node.cmd(
-                        f'ping6 -I {host["port"]} -c{ping_count} -W 1 -i 0.01 {addr}')
-                    sent, received = self.net._parsePing(result)
-                    packets += sent
-                    lost += sent - received
+                for dst in dsts:
+                    result = next(results)
+                    if self.events:
+                        self.events.emit(
+                            "pair", family=family, vlan=str(vlan),
+                            src=host["name"], dst=dst["name"],
+                            src_host=f"h{host['id']}",
+                            dst_host=f"h{dst['id']}",
+                            sent=result.sent, received=result.received,
+                            transient=result.transient)
+                    packets += result.sent
+                    received += result.received
+                    if result.transient:
+                        transient += 1
+                    else:
+                        lost += result.sent - result.received
                     out = 'X'
-                    if received:
+                    if result.received or result.transient:
                         out = dst["name"]
                     output(f'{out} ')
                 output('\n')
         if packets > 0:
             ploss = 100.0 * lost / packets
-            received = packets - lost
             info(f"*** Results: {round(ploss, 2)}% dropped "
                  f"({received}/{packets} received)\n")
+            if transient:
+                info(f"*** {transient} pairs only lost packets transiently "
+                     "and are left out of the packet loss\n")
+            self.emit("sweep", family=family, sent=packets, received=received,
+                      loss=ploss, transient=transient)
             return ploss
 
 
-    def backup_exists(self, link):
-        """ Checks if the switches have a redundant path setup """
-        src_switch, dst_switch = link[0], link[2]
-
-        src_has_other_link = False
-        dst_has_other_link = False
+    def sweep_plan(self, family, select=None, sample=None):
+        """ Lists the sources within each vlan for the address family, along
+            with the destinations each of them should ping. When select is
+            given, only the pairs it accepts are kept, and sources without any
+            destinations left are dropped. When sample is given, sources only
+            ping the destinations sampled for them """
+        plan = []
+        for vlan, members in self.vlan_matrix.items():
+            sources = []
+            if sample is not None:
+                by_id = {dst["id"]: dst for dst in members if family in dst}
+            for host in members:
+                if family not in host:
+                    continue
+                if sample is not None:
+                    dsts = [by_id[dst_id]
+                            for dst_id in sample.get((vlan, host["id"]), ())
+                            if dst_id in by_id]
+                else:
+                    dsts = [dst for dst in members
+                            if dst is not host and family in dst]
+                if select:
+                    dsts = [dst for dst in dsts if select(vlan, host, dst)]
+                if not dsts and (select or sample is not None):
+                    continue
+                sources.append((host, dsts))
+            plan.append((vlan, sources))
+        return plan
+
+
+    def run_probes(self, pairs, family, ping_count=1):
+        """ Pings all (source, destination) pairs with at most
+            ping_concurrency pings in flight. Returns a ProbeResult for each
+            pair, in the same order as the pairs """
+        if self.ping_backend == "socket":
+            try:
+                return self.socket_probes(pairs, family, ping_count)
+            except OSError as err:
+                error("Could not probe using raw sockets, falling back to "
+                      f"the ping command\n{err}\n")
+                self.ping_backend = "ping"
+        workers = max(1, min(self.ping_concurrency, len(pairs)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(
+                lambda pair: self.probe_pair(pair[0], pair[1], family,
+                                             ping_count),
+                pairs))
+
+
+    def probe_pair(self, host, dst, family, ping_count=1):
+        """ Pings the destination from within the source host's namespace.
+            Uses popen rather than cmd, as a host's shell can only run a single
+            command at a time """
+        host_node = self.net.getNodeByName(f"h{host['id']}")
+        ping = "ping" if family == "ipv4" else "ping6"
+        addr = dst[family].split('/')[0]
+        with self.profiler.command(host_node.name, ping):
+            proc = host_node.popen([ping, '-I', host["port"],
+                                    f'-c{ping_count}', '-W', '1', '-i', '0.01',
+                                    addr],
+                                   stdout=PIPE, stderr=STDOUT,
+                                   universal_newlines=True)
+            result, _ = proc.communicate()
+        sent, received = self.net._parsePing(result)
+        if received < sent or not self.log_failed_only:
+            self.logger.debug(result)
+        return ProbeResult(sent, received, parse_rtts(result))
+
+
+    def socket_probes(self, pairs, family, ping_count=1):
+        """ Probes the pairs using raw ICMP sockets opened within each source
+            host's namespace, without spawning any processes """
+        probes = [(self.net.getNodeByName(f"h{host['id']}").pid, host["port"],
+                   family, dst[family].split('/')[0]) for host, dst in pairs]
+        return self.icmp_prober.probe(probes, ping_count)
+
+
+    def build_graph(self):
+        """ Builds the switch graph used for the redundancy checks """
+        switches = list(self.switch_dps or []) + list(self.p4_switches) + \
+                   list(self.unmanaged_switches)
+        return SwitchGraph(self.link_matrix, switches)
+
+
+    def vlan_switches(self):
+        """ Returns the switches that members of each vlan are connected to """
+        return {vlan: {host["switch"] for host in members}
+                for vlan, members in self.vlan_matrix.items()}
+
+
+    def report_bridges(self):
+        """ Warns about core links and switches without a backup path """
+        for link in self.graph.links:
+            if self.graph.edge(link[0], link[2]) in self.graph.bridges:
+                warn(f"Warning: the link between {link[0]} and {link[2]} "
+                     "does not have a backup path\n")
+        for switch in sorted(self.graph.articulation_points):
+            warn(f"Warning: {switch} is a single point of failure\n")
 
-        for l in (i for i in self.link_matrix if i != link):
-            src_has_other_link = True if src_switch in l else src_has_other_link
-            dst_has_other_link = True if dst_switch in l else dst_has_other_link
 
-        if not src_has_other_link:
-            warn(f"Warning: {src_switch} does not have another core link, the "
-                 f"link between {src_switch} and {dst_switch} will not be "
-                 f"turned off\n")
-            return False
-        if not dst_has_other_link:
-            warn(f"Warning: {dst_switch} does not have another core link, the "
-                 f"link between {dst_switch} and {src_switch} will not be "
-                 f"turned off\n")
-            return False
+    def backup_exists(self, link):
+        """ Checks that setting the link down keeps the switches of each
+            vlan's members connected. Only bridges can partition the network,
+            so the other links don't need to be checked any further """
+        src_switch, dst_switch = link[0], link[2]
+        if self.graph.edge(src_switch, dst_switch) not in self.graph.bridges:
+            return True
+        for vlan, switches in self.vlan_switches().items():
+            if not self.graph.connected(switches,
+                                        [(src_switch, dst_switch)]):
+                warn(f"Warning: setting the link between {src_switch} and "
+                     f"{dst_switch} down partitions vlan {vlan}, the link "
+                     "will not be turned off\n")
+                return False
         return True
 
 
@@ -280,18 +1085,11 @@ class ATHOS():
 
         info(f"{datetime.now().strftime('%b %d %H:%M:%S')}\n")
         info('Starting new Testing instance\n')
-        nw_matrix = None
         if args.json_topology:
             error("Direct JSON is not yet supported\n")
             sys.exit()
-        if args.topology_file:
-            nw_matrix = self.open_file(args.topology_file)
-
-        if not args.json_topology and not args.topology_file:
-            nw_matrix = self.open_file(DEFAULT_INPUT_FILE)
-
-        if not nw_matrix:
-            error("No topology discovered. Please check input files\n")
+        if not args.no_cache:
+            self.topology_cache = TopologyCache(args.cache_dir)
 
         try:
             ping_count = int(args.ping)
@@ -299,24 +1097,165 @@ class ATHOS():
             error('Ping input is not a number, using the default ping '
                   'count of 1\n{err}')
 
+        try:
+            self.ping_concurrency = int(args.concurrency)
+        except (TypeError, ValueError) as err:
+            error('Concurrency input is not a number, using the default of '
+                  f'{DEFAULT_PING_CONCURRENCY}\n{err}\n')
+
+        self.ping_backend = args.ping_backend
+        if self.ping_backend == "socket":
+            # Created up front, as the sweeps of both families can start
+            # probing at once with --dual-stack
+            self.icmp_prober = IcmpProber(concurrency=self.ping_concurrency)
+        self.dual_stack = args.dual_stack
+        self.prewarm = args.prewarm
+        self.selective_retest = args.selective_retest
+        self.incremental = args.incremental
+        self.sampled = args.sample
+        self.log_failed_only = args.log_failed_only
+        self.switch_failures = args.switch_failures
+        try:
+            self.max_link_failures = int(args.link_failures)
+        except (TypeError, ValueError) as err:
+            error('Link failures input is not a number, only single links '
+                  f'will be failed\n{err}\n')
+        if args.latency:
+            self.rtts = RttStore()
+        if args.reachability:
+            self.reachability = ReachabilityStore()
+        try:
+            self.retry_budget = int(args.retry_budget)
+            self.retry_count = int(args.retry_count)
+        except (TypeError, ValueError) as err:
+            error('Retry options are not numbers, pairs that lose packets '
+                  f'will not be retried\n{err}\n')
+            self.retry_budget = 0
+        if args.convergence:
+            self.convergence = []
+            try:
+                self.convergence_pairs = int(args.convergence_pairs)
+                self.convergence_interval = \
+                    int(args.convergence_interval) / 1000
+            except (TypeError, ValueError) as err:
+                error('Convergence options are not numbers, using the '
+                      f'defaults\n{err}\n')
+        if args.events:
+            try:
+                self.events = EventStream(args.events)
+            except OSError as err:
+                error(f"Unable to write events to {args.events}\n{err}\n")
+        self.emit("run_start", topology=args.topology_file or
+                  DEFAULT_INPUT_FILE)
+        self.profiler = Profiler(args.profile or args.trace_events,
+                                 self.events)
+
         t_port = None
         if args.thrift_port:
             t_port = args.thrift_port
 
-        if nw_matrix:
-            self.parse_config(nw_matrix)
-            self.build_network(t_port)
-            self.net.start()
-            self.cleanup_ips()
+        with self.profiler.phase("parse_config"):
+            loaded = self.load_topology(args.topology_file or
+                                        DEFAULT_INPUT_FILE)
+        if not loaded:
+            error("No topology discovered. Please check input files\n")
+        else:
+            self.emit("topology", members=len(self.member_digests),
+                      digest=config_digest([self.switch_digest,
+                                            self.member_digests]))
+            if args.dry_run:
+                self.dry_run()
+                return
+            members = None
+            if self.incremental:
+                members = self.changed_members(args.cache_dir)
+            with self.profiler.phase("build_network"):
+                self.build_network(t_port)
+            with self.profiler.phase("net.start"):
+                self.net.start()
+            with self.profiler.phase("cleanup_ips"):
+                self.cleanup_ips()
+            if self.prewarm:
+                with self.profiler.phase("prewarm_neighbours"):
+                    self.prewarm_neighbours()
 
             if args.script:
-                ATHOS.run_start_script(args.script)
+                with self.profiler.phase("start script"):
+                    ATHOS.run_start_script(args.script)
 
             if args.cli:
+                from mininet.cli import CLI
                 CLI(self.net)
+            elif args.daemon:
+                self.serve(args.control_socket or DEFAULT_CONTROL_SOCKET,
+                           ping_count,
+                           args.topology_file or DEFAULT_INPUT_FILE)
             else:
-                self.test_network(args.no_redundancy, ping_count)
-            self.net.stop()
+                with self.profiler.phase("test_network"):
+                    passed = self.test_network(args.no_redundancy, ping_count,
+                                               members)
+                self.emit("run_end", passed=bool(passed))
+                if passed:
+                    store_last_run(args.cache_dir, {
+                        "switch_digest": self.switch_digest,
+                        "member_digests": self.member_digests,
+                        "port_ids": self.port_ids
+                    })
+            if self.icmp_prober:
+                self.icmp_prober.close()
+            with self.profiler.phase("net.stop"):
+                self.net.stop()
+            log_dir = os.path.dirname(args.log_file or DEFAULT_LOG_FILE)
+            if self.rtts:
+                self.report_latency(log_dir)
+            if self.reachability:
+                self.report_reachability(log_dir)
+            if self.convergence:
+                self.report_convergence(log_dir)
+            if self.profiler.enabled:
+                for path in self.profiler.export(log_dir, args.trace_events):
+                    info(f"Profile written to {path}\n")
+        if self.events:
+            self.events.close()
+
+
+    def serve(self, path, ping_count=1, topology_file=None):
+        """ Keeps the network up and serves requests on the control socket
+            until asked to shut down """
+        self.graph = self.build_graph()
+        with self.profiler.phase("daemon"):
+            ControlServer(self, path, ping_count, topology_file).serve()
+
+
+    def changed_members(self, state_dir):
+        """ Compares the topology with the last successful run, giving the
+            hosts of unchanged members the same ids as before. Returns the
+            members that need to be tested, or None if all of them do """
+        state = load_last_run(state_dir)
+        if not state:
+            info("*** No previous run found, testing all members\n")
+            return None
+        if state["switch_digest"] != self.switch_digest:
+            info("*** The switches have changed since the last run, testing "
+                 "all members\n")
+            return None
+        self.port_ids = state["port_ids"]
+        self.assign_port_ids()
+        diff = diff_members(state["member_digests"], self.member_digests)
+        info(f"*** {len(diff.added)} members added, {len(diff.removed)} "
+             f"removed and {len(diff.changed)} changed since the last run\n")
+        return diff.affected
+
+
+    def dry_run(self):
+        """ Checks the expected reachability from the topology alone, without
+            building the network. Exits with an error if problems are found """
+        switches = list(self.switch_dps or []) + list(self.p4_switches) + \
+                   list(self.unmanaged_switches)
+        problems = DryRun(self.hosts_matrix, self.vlan_to_host_id,
+                          self.build_graph(), switches).run()
+        if problems:
+            sys.exit(1)
 
 
     def parse_json(self, json_string):
@@ -355,155 +1294,94 @@ class ATHOS():
 
 
     def parse_config(self, nw_matrix):
-        """ Parses and validates the config """
-        err_msg = "Malformed config detected! "
-        try:
-            if "hosts_matrix" not in nw_matrix:
-                raise ConfigError(f"{err_msg}No 'hosts_matrix' found\n")
-            if "switch_matrix" not in nw_matrix:
-                raise ConfigError(f"{err_msg}No 'hosts_matrix' found\n")
-        except ConfigError as err:
-            error(err)
+        """ Parses and validates the config, reporting every error found
+            before exiting """
+        if not self.check_config(nw_matrix):
             sys.exit()
-        self.check_hosts_config(nw_matrix["hosts_matrix"])
-        self.check_switch_config(nw_matrix["switch_matrix"])
-        self.hosts_matrix = self.flatten_nw_matrix(nw_matrix)
-
-
-    def check_hosts_config(self, host_matrix):
-        """ Parses and validates the hosts matrix """
-        err_msg = ("Malformed config detected in the hosts section!\n" +
-                   "Please check the config:\n")
-        if not host_matrix:
-            error(f"{err_msg}The hosts_matrix doesn't have any content\n")
-
-        for host in host_matrix:
-            malformed = False
-            if "name" not in host:
-                error(f"{err_msg}Entry detected without a name\n")
-                malformed = True
-
-            if "interfaces" not in host:
-                error(f"{err_msg}Entry detected without any interfaces\n")
-                malformed = True
-            if malformed:
-                sys.exit()
-
-            self.check_host_interfaces(err_msg, host)
-
-
-    def check_host_interfaces(self, err_msg, host):
-        """ Parse and validates the host's interfaces """
-        err_msg = err_msg + f"Host: {host['name']} has an error"
-
-        try:
-            if not host["interfaces"]:
-                raise ConfigError(f"{err_msg} interfaces section is empty")
-
-            for iface in host["interfaces"]:
-                if "swport" not in iface:
-                    raise ConfigError(f"{err_msg}. It does not have a " +
-                                      "switch port\n")
-                if "switch" not in iface:
-                    raise ConfigError(f"{err_msg}. It does not have an " +
-                                      "assigned switch\n")
-                if "ipv4" in iface:
-                    self.check_ipv4_address(err_msg, iface["ipv4"])
-                if "ipv6" in iface:
-                    self.check_ipv6_address(err_msg, iface["ipv6"])
-                if "ipv4" not in iface and "ipv6" not in iface:
-                    raise ConfigError(f"{err_msg}. It has neither an IPv4" +
-                                      " or IPv6 address\n")
-                if "mac" not in iface:
-                    iface["mac"] = \
-                        self.check_for_available_mac(err_msg, iface,
-                                                     host["interfaces"])
-                if "mac" in iface:
-                    self.check_mac_address(err_msg, iface["mac"])
-                if "vlan" in iface:
-                    self.check_vlan_validity(err_msg, iface["vlan"])
-
-        except ConfigError as err:
-            error(err + "\n")
-            sys.exit()
-
-    def check_ipv4_address(self, err_msg, v4_address):
-        """ Checks validity of ipv4 address """
-        try:
-            if not v4_address:
-                raise ConfigError(f"{err_msg} please check that ipv4 sections "
-                                  "have addresses assigned\n")
-            if "." not in v4_address or "/" not in v4_address:
-                raise ConfigError(f"{err_msg} in the ipv4 section\n"
-                                  f"IPv4 section: {v4_address}\n")
-        except ConfigError as err:
-            error(err)
-            sys.exit()
-
-
-    def check_ipv6_address(self, err_msg, v6_address):
-        """ Checks validity of ipv6 address """
-        try:
-            if not v6_address:
-                raise ConfigError(f"{err_msg} please check that ipv6 sections" +
-                                  "have addresses assigned\n")
-            if ":" not in v6_address or "/" not in v6_address:
-                raise ConfigError(f"{err_msg} in the ipv6 section\n" +
-                                  f"IPv6 section: {v6_address}\n")
-        except ConfigError as err:
-            error(err)
-            sys.exit()
-
-
-    def check_mac_address(self, err_msg, mac_address):
-        """ Checks validity of MAC address """
-        try:
-            if not mac_address:
-                raise ConfigError(f"{err_msg} please check that MAC sections" +
-                                  "have addresses assigned\n")
-            if ":" not in mac_address:
-                raise ConfigError(f"{err_msg} in the MAC section. Currently "
-                                  "only addresses seperated with : is "
-                                  f"supported.\nMAC section: {mac_address}\n")
-        except ConfigError as err:
-            error(err)
-            sys.exit()
-
-
-    def check_for_available_mac(self, err_msg, iface, host_interfaces):
-        """ Checks if port another mac address is assigned to the port """
-        mac = ""
-        try:
-            for other_iface in host_interfaces:
-                if iface is other_iface:
-                    continue
-
-                if iface["switch"] == other_iface["switch"] and \
-                iface["swport"] == other_iface["swport"] and \
-                "mac" in other_iface:
+        self.load_config(nw_matrix)
+
+
+    def check_config(self, nw_matrix):
+        """ Validates the config, reporting any warnings and every error
+            found. Returns whether the config is valid """
+        validator = ConfigValidator()
+        errors = validator.validate(nw_matrix)
+        self.config_warnings = validator.warnings
+        for msg in self.config_warnings:
+            warn(f"{msg}\n")
+        if errors:
+            error("Malformed config detected! Please check the config:\n")
+            for msg in errors:
+                error(f"{msg}\n")
+            error(f"{len(errors)} errors found in the config\n")
+            return False
+        return True
 
-                    mac = other_iface["mac"]
 
-            if not mac:
-                raise ConfigError(f"{err_msg} in the mac section. " +
-                                  "No mac address was provided\n")
-        except ConfigError as err:
-            error(err)
+    def load_config(self, nw_matrix):
+        """ Loads a validated config, flattening the hosts into a namespace
+            per switch port """
+        sw_matrix = nw_matrix["switch_matrix"]
+        self.switch_digest = config_digest(sw_matrix)
+        self.member_digests = member_digests(nw_matrix["hosts_matrix"])
+        if "dp_ids" in sw_matrix:
+            self.switch_dps = sw_matrix["dp_ids"]
+        if "p4" in sw_matrix:
+            self.p4_switches = sw_matrix["p4"]
+        if "unmanaged_switches" in sw_matrix:
+            self.unmanaged_switches = sw_matrix["unmanaged_switches"]
+        self.link_matrix = sw_matrix["links"]
+        self.vlan_to_host_id = []
+        self.hosts_matrix = self.flatten_nw_matrix(nw_matrix)
+        self.assign_port_ids()
 
-        return mac
 
+    def assign_port_ids(self):
+        """ Gives each namespace the id it had before, so that the hosts of
+            unchanged members keep their names across topology changes. New
+            namespaces are numbered after the highest id used before """
+        ifaces = self.hosts_matrix + self.vlan_to_host_id
+        if not self.port_ids:
+            self.port_ids = {port_key(iface): iface["id"] for iface in ifaces}
+            return
+        next_id = max(self.port_ids.values()) + 1
+        port_ids = {}
+        for iface in ifaces:
+            key = port_key(iface)
+            if key not in port_ids:
+                port_ids[key] = self.port_ids.get(key, next_id)
+                if port_ids[key] == next_id:
+                    next_id += 1
+            iface["id"] = port_ids[key]
+        self.port_ids = port_ids
+
+
+    def load_topology(self, input_file):
+        """ Loads the validated and flattened topology from the cache if
+            possible, otherwise opens, parses and caches it. Returns False if
+            no topology could be loaded """
+        key = None
+        if self.topology_cache:
+            key = self.topology_cache.key(input_file)
+            model = self.topology_cache.load(key)
+            if model:
+                info(f"Using cached topology {self.topology_cache.path(key)}\n")
+                for field in MODEL_FIELDS:
+                    setattr(self, field, model[field])
+                self.assign_port_ids()
+                for msg in self.config_warnings:
+                    warn(f"{msg}\n")
+                return True
+        nw_matrix = self.open_file(input_file)
+        if not nw_matrix:
+            return False
+        self.parse_config(nw_matrix)
+        if self.topology_cache:
+            self.topology_cache.store(key, {
+                field: getattr(self, field)
+                for field in MODEL_FIELDS})
+        return True
 
-    def check_vlan_validity(self, err_msg, vlan):
-        """ Checks that the assigned vlan is a valid value """
-        try:
-            vid = int(vlan)
-            if vid < 0 or vid > 4095:
-                raise ConfigError(f"{err_msg}. Invalid vlan id(vid) detected. "
-                                  "A valid vid should be between 1 and 4095.\n"
-                                  f"Found vid: {vid}\n")
-        except (ConfigError, ValueError) as err:
-            error(err)
-            sys.exit()
 
     def packet_loss_threshold_passed(self, v4_loss, v6_loss, src_switch=None,
                                      dst_switch=None, status=""):
@@ -513,8 +1391,15 @@ class ATHOS():
         if src_switch and dst_switch:
             link_error_msg = (f" when the link between {src_switch} and "
                               f"{dst_switch} was set {status}.")
+        elif status:
+            link_error_msg = f" {status}."
         else:
             link_error_msg = (f" before any links were changed.")
+        self.emit("verdict",
+                  passed=not any(loss and loss > self.ploss_threshold
+                                 for loss in (v4_loss, v6_loss)),
+                  ipv4=v4_loss, ipv6=v6_loss, threshold=self.ploss_threshold,
+                  context=link_error_msg.strip(" ."))
 
         if v4_loss and v4_loss > self.ploss_threshold \
             and v6_loss and v6_loss > self.ploss_threshold:
@@ -537,53 +1422,6 @@ class ATHOS():
             return True
 
 
-    def check_switch_config(self, sw_matrix):
-        """ Parses and validates the switch matrix """
-        err_msg = ("Malformed config detected in the switch section!\n" +
-                   "Please check the config:\n")
-        try:
-            if not sw_matrix:
-                raise ConfigError(f"{err_msg}Switch matrix is empty\n")
-            if "links" not in sw_matrix:
-                raise ConfigError(f"{err_msg}No links section found\n")
-            for link in sw_matrix["links"]:
-                if len(link) != 4:
-                    raise ConfigError(f"{err_msg}Invalid link found. The "
-                        "expected link format should be:\n"
-                        "[switchA,portA,switchB,portB]\nWhere portA is the port"
-                        " on switchA connected to switchB, and vice versa "
-                        f"for portB\nLink found: {link}\n")
-                port_a = int(link[1])
-                port_b = int(link[3])
-
-                if port_a < 0 or port_a > 255 or port_b < 0 or port_b > 255:
-                    raise ConfigError("Invalid port number detected. Ensure "
-                                      "that port numbers are between 0 and 255 "
-                                      f"sw1_port: {port_a}\t sw2_port:{port_b}\n")
-            if "dp_ids" not in sw_matrix:
-                warn(f"{err_msg}No dp_id section found, dp_ids generated in "
-                     "Mininet might not match those in controller config\n")
-            else:
-                for _, dp_id in sw_matrix["dp_ids"].items():
-                    if not hex(dp_id):
-                        raise ConfigError(f"{err_msg}Please ensure that dp_ids "
-                                          "are valid numbers\n")
-                self.switch_dps = sw_matrix["dp_ids"]
-            if "p4" in sw_matrix:
-                self.p4_switches = sw_matrix["p4"]
-            if "unmanaged_switches" in sw_matrix:
-                self.unmanaged_switches = sw_matrix["unmanaged_switches"]
-            self.link_matrix = sw_matrix["links"]
-
-        except ConfigError as err:
-            error(err)
-            sys.exit()
-        except ValueError as err:
-            error(f"{err_msg}Please check value of port numbers and vlan ids\n")
-            error(err)
-            sys.exit()
-
-
     def flatten_nw_matrix(self, nw_matrix):
         """ Flattens out the topology matrix turning each interface into a
             separate namespace """
@@ -648,69 +1486,3 @@ class ATHOS():
             flattened_matrix.extend(ifaces)
 
         return flattened_matrix
-
-
-    class MyTopo(Topo):
-        """ Custom topology generator """
-
-        def __init__(self, hosts_matrix=None, switch_matrix=None,
-                     switch_dps=None, p4_switches=None,
-                     unmanaged_switches=None,
-                     sw_path=DEFAULT_P4_SWITCH,
-                     p4_json=DEFAULT_UMBRELLA_JSON,
-                     logger=None,
-                     thrift_port_base=9190):
-            """ Create a topology based on input JSON"""
-
-            # Initialize topology
-            Topo.__init__(self)
-            switch_list = []
-            self.logger = logger
-
-            for sw in switch_dps:
-                dp_id = switch_dps[sw]
-                switch_list.append(sw)
-                self.addSwitch(sw, dpid='%x' % dp_id)
-            if p4_switches:
-                info('Adding p4 switches:')
-                i = 0
-                for sw in p4_switches:
-                    info(f'{sw}')
-                    # Need to allow for multiple p4 switches to be used
-                    # Can't use 9090 due to promethues clash
-                    t_port = int(thrift_port_base) + int(i)
-                    i += 1
-                    self.addSwitch(sw, cls=P4Switch,
-                                   sw_path=sw_path,
-                                   json_path=p4_json,
-                                   thrift_port=t_port
-                                   )
-                    switch_list.append(sw)
-            if unmanaged_switches:
-                for sw in unmanaged_switches:
-                    self.addSwitch(sw, failMode="standalone")
-            for switch in switch_matrix:
-                self.addLink(switch[0], switch[2],
-                             int(switch[1]), int(switch[3]))
-            for host in hosts_matrix:
-                self.host_add(host)
-
-
-        def host_add(self, host):
-            """ Adds the host to the network """
-            hname = f"h{host['id']}"
-            if "ipv4" in host and "vlan" not in host:
-                self.addHost(hname, ip=host["ipv4"], mac=host["mac"],
-                             intf="eth-0")
-            if "ipv4" in host and "tagged" in host and not host["tagged"]:
-                self.addHost(hname, ip=host["ipv4"], mac=host["mac"],
-                             intf="eth-0")
-            else:
-                self.addHost(hname, ip="127.0.0.1/32", mac=host["mac"],
-                             intf="eth-0")
-            self.addLink(host["switch"], hname, host["swport"])
-
-
-class ConfigError(Exception):
-    """ Exception handler for misconfigured configurations """
-    pass
@@ -0,0 +1,109 @@
+""" Topology model cache
+
+Stores the validated and flattened topology on disk, keyed by a hash of the
+topology file and the ATHOS version, so that repeat runs against the same
+topology can skip parsing and validating it """
+
+import hashlib
+import json
+import os
+import tempfile
+from mininet.log import debug, warn
+
+
+DEFAULT_CACHE_DIR = "/var/cache/athos"
+CACHE_FORMAT = 2 # Bump when the layout of the cached model changes
+MODEL_FIELDS = ("hosts_matrix", "vlan_to_host_id", "link_matrix",
+                "switch_dps", "p4_switches", "unmanaged_switches",
+                "config_warnings", "member_digests", "switch_digest")
+
+
+def athos_version():
+    """ Returns the installed version of ATHOS. When running from a source
+        tree without package metadata, a digest of the modules that build the
+        model is used instead, so that code changes invalidate the cache """
+    try:
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            return version("athos")
+        except PackageNotFoundError:
+            pass
+    except ImportError:
+        pass
+    digest = hashlib.sha256()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in ("athos.py", "validator.py", "cache.py"):
+        with open(os.path.join(src_dir, module), "rb") as src_file:
+            digest.update(src_file.read())
+    return f"src-{digest.hexdigest()[:16]}"
+
+
+class TopologyCache():
+    """ On disk cache of parsed topology models.
+
+        Each model is stored as a JSON file named after the key, which is a
+        sha256 of the cache format, the ATHOS version and the raw bytes of the
+        topology file. Failing to read or write the cache is never fatal. """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.version = athos_version()
+
+
+    def key(self, input_file):
+        """ Hashes the topology file along with the version. Returns None if
+            the file can't be read """
+        digest = hashlib.sha256(f"{CACHE_FORMAT}:{self.version}:".encode())
+        try:
+            with open(input_file, "rb") as topo_file:
+                for chunk in iter(lambda: topo_file.read(1 << 16), b""):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return digest.hexdigest()
+
+
+    def path(self, key):
+        """ Location of the cached model for the key """
+        return os.path.join(self.cache_dir, f"topology_{key}.json")
+
+
+    def load(self, key):
+        """ Returns the cached model for the key, or None on a miss """
+        if not key:
+            return None
+        try:
+            with open(self.path(key)) as cache_file:
+                model = json.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            warn(f"Ignoring unreadable topology cache {self.path(key)}: "
+                 f"{err}\n")
+            return None
+        if not isinstance(model, dict) or \
+           any(field not in model for field in MODEL_FIELDS):
+            warn(f"Ignoring incomplete topology cache {self.path(key)}\n")
+            return None
+        return model
+
+
+    def store(self, key, model):
+        """ Atomically writes the model for the key """
+        if not key:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile("w", dir=self.cache_dir,
+                                             suffix=".tmp",
+                                             delete=False) as tmp_file:
+                tmp_path = tmp_file.name
+                json.dump({field: model[field] for field in MODEL_FIELDS},
+                          tmp_file)
+            os.replace(tmp_path, self.path(key))
+        except OSError as err:
+            debug(f"Unable to write the topology cache to {self.cache_dir}: "
+                  f"{err}\n")
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
@@ -0,0 +1,71 @@
+""" Failover convergence measurement
+
+Works out how long traffic was disrupted by a link event from the output of
+a continuous `ping -D -O` stream that was running across it. Every reply is
+timestamped by ping, which gives the time each request was sent. The outage
+runs from the first request lost after the event to the first request that
+was answered again """
+
+import re
+import statistics
+
+
+REPLY_PATTERN = re.compile(
+    r"^\[([\d.]+)\] .*icmp_seq=(\d+) .*time[=<]([\d.]+) ms")
+TRANSMITTED_PATTERN = re.compile(r"(\d+) packets transmitted")
+TAIL_GRACE = 0.2 # Seconds at the end of a stream where replies may be in flight
+
+
+def parse_stream(ping_output):
+    """ Parses the output of ping -D. Returns the send time of each answered
+        sequence number, and the amount of requests sent """
+    sent_at = {}
+    for line in ping_output.splitlines():
+        match = REPLY_PATTERN.match(line)
+        if match:
+            received, seq, rtt = match.groups()
+            sent_at[int(seq)] = float(received) - float(rtt) / 1000
+    match = TRANSMITTED_PATTERN.search(ping_output)
+    sent = int(match.group(1)) if match else max(sent_at, default=0)
+    return sent_at, sent
+
+
+def measure_outage(ping_output, event_time, interval):
+    """ Measures the outage caused by an event at event_time from a stream
+        sending a request every interval seconds. The send time of lost
+        requests is estimated from the answered ones, as ping sends them at a
+        fixed interval. Requests still in flight when the stream was stopped
+        aren't counted as lost. Returns a summary, where outage_ms is None if
+        nothing was lost and recovered is False if the stream never
+        recovered """
+    sent_at, sent = parse_stream(ping_output)
+    result = {"sent": sent, "received": len(sent_at), "lost": 0,
+              "outage_ms": None, "recovered": True}
+    if not sent_at:
+        result.update(lost=sent, recovered=False)
+        return result
+    start = statistics.median(ts - (seq - 1) * interval
+                              for seq, ts in sent_at.items())
+
+    def send_time(seq):
+        return sent_at.get(seq, start + (seq - 1) * interval)
+
+    last_answered = max(sent_at)
+    if send_time(sent) - send_time(last_answered) < TAIL_GRACE:
+        sent = last_answered
+        result["sent"] = sent
+    lost = [seq for seq in range(1, sent + 1) if seq not in sent_at and
+            send_time(seq) >= event_time - interval]
+    result["lost"] = len(lost)
+    if not lost:
+        return result
+    first_lost = lost[0]
+    recovered = [seq for seq in sent_at if seq > first_lost]
+    if not recovered:
+        result["recovered"] = False
+        result["outage_ms"] = round((send_time(sent) - send_time(first_lost)
+                                     + interval) * 1000, 3)
+        return result
+    result["outage_ms"] = round((send_time(min(recovered)) -
+                                 send_time(first_lost)) * 1000, 3)
+    return result
@@ -0,0 +1,260 @@
+""" ATHOS control daemon
+
+Keeps the emulated network up after it has been built and serves requests
+over a local Unix socket, so that repeated checks don't pay for setting up
+Mininet and OVS again. Requests and responses are JSON objects, one per line:
+
+    {"cmd": "sweep", "family": "ipv4"}
+    {"cmd": "fail_link", "src": "s1", "dst": "s2"}
+    {"cmd": "retest_vlan", "vlan": 1234}
+    {"cmd": "reload", "topology": "/etc/athos/topology.json"}
+    {"cmd": "test"}
+    {"cmd": "status"}
+    {"cmd": "shutdown"}
+
+Each response has "ok" set, along with "error" when the request failed """
+
+import json
+import os
+import socket
+import socketserver
+import time
+import traceback
+from mininet.log import info, error
+
+
+DEFAULT_CONTROL_SOCKET = "/run/athos/athos.sock"
+FAMILIES = ("ipv4", "ipv6")
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    """ Reads requests from a client connection and writes a response to
+        each of them """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as err:
+                response = {"ok": False, "error": f"Invalid request: {err}"}
+            else:
+                response = self.server.dispatch(request)
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+            if not self.server.running:
+                break
+
+
+class ControlServer(socketserver.UnixStreamServer):
+    """ Serves requests against a running ATHOS network.
+
+        Requests are handled one at a time, as the network can only be
+        tested by one request at once. A client that keeps its connection
+        open holds off other clients until it disconnects. """
+
+    def __init__(self, athos, path=DEFAULT_CONTROL_SOCKET, ping_count=1,
+                 topology_file=None):
+        self.athos = athos
+        self.path = path
+        self.ping_count = ping_count
+        self.topology_file = topology_file
+        self.running = True
+        self.started = time.monotonic()
+        self.requests = 0
+        self.commands = {
+            "sweep": self.sweep,
+            "fail_link": self.fail_link,
+            "retest_vlan": self.retest_vlan,
+            "reload": self.reload,
+            "test": self.test,
+            "status": self.status,
+            "shutdown": self.shutdown_daemon
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, ControlHandler)
+        os.chmod(path, 0o600)
+
+
+    def serve(self):
+        """ Handles requests until a shutdown request is received """
+        info(f"*** Listening for requests on {self.path}\n")
+        try:
+            while self.running:
+                self.handle_request()
+        except KeyboardInterrupt:
+            info("*** Interrupted, stopping the daemon\n")
+        finally:
+            self.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+
+    def dispatch(self, request):
+        """ Runs the command for the request and returns the response """
+        self.requests += 1
+        cmd = request.get("cmd")
+        if cmd not in self.commands:
+            return {"ok": False, "error": f"Unknown command: {cmd}. "
+                                          "Available commands: "
+                                          f"{', '.join(self.commands)}"}
+        info(f"*** Request: {json.dumps(request)}\n")
+        try:
+            response = self.commands[cmd](request)
+        except Exception as err:
+            # Anything left to socketserver would drop the connection without
+            # a response
+            error(f"Request {cmd} failed: {err}\n{traceback.format_exc()}")
+            return {"ok": False, "error": f"{type(err).__name__}: {err}"}
+        response.setdefault("ok", True)
+        return response
+
+
+    def count(self, request):
+        """ Ping count for the request, defaulting to the daemon's """
+        return int(request.get("count", self.ping_count))
+
+
+    def losses(self, v4_loss, v6_loss, **status):
+        """ Response with the packet loss of each family and whether it is
+            within the threshold """
+        return {
+            "ipv4": v4_loss,
+            "ipv6": v6_loss,
+            "passed": self.athos.packet_loss_threshold_passed(
+                v4_loss, v6_loss, **status)
+        }
+
+
+    def sweep(self, request, select=None):
+        """ Sweeps one or both address families """
+        family = request.get("family")
+        if family is None:
+            return self.losses(*self.athos.ping_all(self.count(request),
+                                                    select=select))
+        if family not in FAMILIES:
+            raise ValueError(f"family should be one of {FAMILIES}")
+        if family == "ipv4":
+            return self.losses(self.athos.ping_vlan_v4(self.count(request),
+                                                       select), None)
+        return self.losses(None, self.athos.ping_vlan_v6(self.count(request),
+                                                         select))
+
+
+    def fail_link(self, request):
+        """ Sets the links between two switches down and back up, sweeping
+            after each change """
+        src, dst = request["src"], request["dst"]
+        graph = self.athos.graph
+        if dst not in graph.adjacency.get(src, ()):
+            raise ValueError(f"No link between {src} and {dst}")
+        link = next(link for link in graph.links
+                    if graph.edge(link[0], link[2]) == graph.edge(src, dst))
+        select = None
+        if self.athos.selective_retest:
+            select = self.athos.crossing_pairs(link)
+        response = {}
+        try:
+            self.set_link(src, dst, link, "down")
+            response["down"] = self.link_losses(src, dst, "down", select,
+                                                request)
+        finally:
+            # The link comes back up even if the sweep failed, as every later
+            # request would otherwise test a degraded network
+            self.set_link(src, dst, link, "up")
+        response["up"] = self.link_losses(src, dst, "up", select, request)
+        response["passed"] = all(response[status]["passed"]
+                                 for status in ("down", "up"))
+        return response
+
+
+    def set_link(self, src, dst, link, status):
+        """ Sets the link down or up, starting a phase for the change """
+        info(f"Setting link between {src} and {dst} {status}\n")
+        self.athos.begin_phase(f"{src}-{dst} {status}")
+        self.athos.set_link_status(link, status)
+
+
+    def link_losses(self, src, dst, status, select, request):
+        """ Sweeps with the link set to the status """
+        return self.losses(
+            *self.athos.ping_all(self.count(request), select=select),
+            src_switch=src, dst_switch=dst, status=status)
+
+
+    def retest_vlan(self, request):
+        """ Sweeps the pairs within a single vlan """
+        vlan = str(request["vlan"])
+        if vlan not in {str(vid) for vid in self.athos.vlan_matrix}:
+            raise ValueError(f"Unknown vlan: {vlan}")
+        return self.sweep(request,
+                          select=lambda vid, host, dst: str(vid) == vlan)
+
+
+    def reload(self, request):
+        """ Applies a new topology file to the running network, and tests the
+            pairs involving the members that changed unless asked not to """
+        path = request.get("topology", self.topology_file)
+        if not os.path.isfile(path):
+            raise ValueError(f"Topology file not found: {path}")
+        nw_matrix = self.athos.open_file(path)
+        if not nw_matrix:
+            raise ValueError(f"Unable to read the topology from {path}")
+        diff = self.athos.reload_topology(nw_matrix)
+        if diff is None:
+            raise ValueError("The topology could not be applied, see the log")
+        self.topology_file = path
+        response = {field: sorted(getattr(diff, field))
+                    for field in diff._fields}
+        if request.get("retest", True) and diff.affected:
+            response.update(self.sweep(
+                request, select=self.athos.member_pairs(diff.affected)))
+        return response
+
+
+    def test(self, request):
+        """ Runs the full test, as done without the daemon. Any link the test
+            leaves down is set back up, so later requests test the network
+            as it was """
+        down = set(self.athos.links_down)
+        try:
+            return {"passed": bool(self.athos.test_network(
+                request.get("no_redundancy", False), self.count(request)))}
+        finally:
+            self.athos.restore_links([link for key, link in
+                                      list(self.athos.links_down.items())
+                                      if key not in down])
+
+
+    def status(self, _request):
+        """ Reports what the daemon is serving """
+        return {
+            "topology": self.topology_file,
+            "uptime": round(time.monotonic() - self.started, 3),
+            "requests": self.requests,
+            "members": len(self.athos.member_digests),
+            "hosts": len({iface["id"] for iface in self.athos.hosts_matrix}),
+            "vlans": sorted(str(vlan) for vlan in self.athos.vlan_matrix),
+            "links": [[link[0], link[2]] for link in self.athos.graph.links]
+        }
+
+
+    def shutdown_daemon(self, _request):
+        """ Stops serving once the response has been sent """
+        self.running = False
+        return {}
+
+
+def send_request(path, request):
+    """ Sends a request to a running daemon and returns its response """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(request) + "\n").encode())
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile() as responses:
+            return json.loads(responses.readline())
@@ -0,0 +1,174 @@
+""" Dry run reachability checker
+
+Predicts the reachability that ATHOS should find from the topology alone,
+without starting Mininet. This catches problems such as vlan mismatches,
+members on switches that can't reach each other and tagged/untagged conflicts
+before paying for a real emulation. Malformed configs and duplicate addresses
+are already caught by the config validator """
+
+from collections import Counter, defaultdict
+from ipaddress import ip_interface
+from mininet.log import info, error, warn
+
+
+FAMILIES = ("ipv4", "ipv6")
+
+
+class DryRun():
+    """ In memory model of the hosts, vlans and switches of a topology.
+
+        Takes the flattened hosts matrix and vlan interfaces produced by
+        ATHOS.flatten_nw_matrix along with the switch graph, and works out
+        which pairs of interfaces should be able to reach each other within
+        each vlan and address family, both with all links up and with each
+        single core link down. """
+
+    def __init__(self, hosts_matrix, vlan_to_host_id, graph, switches):
+        self.hosts_matrix = hosts_matrix
+        self.vlan_to_host_id = vlan_to_host_id
+        self.graph = graph
+        self.switches = set(switches)
+        self.problems = 0
+        self.vlans = self.vlan_members()
+
+
+    def vlan_members(self):
+        """ Groups the interfaces by vlan, the same way cleanup_ips does """
+        vlans = {"none": [iface for iface in self.hosts_matrix
+                          if "vlan" not in iface]}
+        for iface in self.vlan_to_host_id:
+            vlans.setdefault(iface["vlan"], []).append(iface)
+        return vlans
+
+
+    def run(self):
+        """ Runs all of the checks and reports the expected reachability.
+            Returns the amount of problems found """
+        info("*** Dry run: checking the topology without starting mininet\n")
+        self.check_switches()
+        self.check_ports()
+        self.check_vlans()
+        self.report_reachability()
+        self.report_link_failures()
+        if self.problems:
+            error(f"Dry run found {self.problems} problems\n")
+        else:
+            info("Dry run found no problems\n")
+        return self.problems
+
+
+    def problem(self, msg):
+        """ Reports a problem that would cause the test to fail """
+        self.problems += 1
+        error(f"{msg}\n")
+
+
+    def check_switches(self):
+        """ Checks that hosts are attached to switches that will exist """
+        for vlan, members in self.vlans.items():
+            for iface in members:
+                if iface["switch"] not in self.switches:
+                    self.problem(f"{iface['name']} in vlan {vlan} is "
+                                 f"attached to unknown switch {iface['switch']}")
+
+
+    def check_ports(self):
+        """ Checks for switch ports that carry more than one untagged vlan, or
+            the same vlan more than once """
+        untagged = defaultdict(set)
+        tagged = defaultdict(Counter)
+        for vlan, members in self.vlans.items():
+            for iface in members:
+                port = (iface["switch"], iface["swport"])
+                if vlan != "none" and "tagged" not in iface:
+                    self.problem(f"{iface['name']} has vlan {vlan} on "
+                                 f"{port[0]} port {port[1]} without stating "
+                                 "if it is tagged")
+                elif vlan == "none" or not iface["tagged"]:
+                    untagged[port].add(vlan)
+                else:
+                    tagged[port][vlan] += 1
+        for port, vlans in untagged.items():
+            if len(vlans) > 1:
+                self.problem(f"{port[0]} port {port[1]} has conflicting "
+                             f"untagged vlans: {sorted(vlans, key=str)}")
+            for vlan in vlans & set(tagged[port]):
+                self.problem(f"{port[0]} port {port[1]} carries vlan {vlan} "
+                             "both tagged and untagged")
+        for port, counts in tagged.items():
+            for vlan, count in counts.items():
+                if count > 1:
+                    self.problem(f"{port[0]} port {port[1]} has vlan {vlan} "
+                                 f"tagged {count} times")
+
+
+    def check_vlans(self):
+        """ Warns about vlans where members can't reach each other because
+            they have nobody to talk to or are in different subnets """
+        for vlan, members in self.vlans.items():
+            if len({iface["name"] for iface in members}) == 1:
+                warn(f"Vlan {vlan} only has a single member: "
+                     f"{members[0]['name']}\n")
+            for family in FAMILIES:
+                subnets = Counter(self.subnet(iface, family) for iface in members
+                                  if family in iface)
+                if len(subnets) > 1:
+                    self.problem(f"Vlan {vlan} has {family} addresses in "
+                                 "different subnets: " + ", ".join(
+                                     f"{subnet} ({count})"
+                                     for subnet, count in subnets.items()))
+
+
+    @staticmethod
+    def subnet(iface, family):
+        """ Returns the subnet of the interface's address """
+        try:
+            return str(ip_interface(iface[family]).network)
+        except ValueError:
+            return iface[family]
+
+
+    def reachable_pairs(self, members, family, labels):
+        """ Counts the pairs that should reach each other, being those in the
+            same switch component and subnet, along with the total pairs """
+        groups = Counter((labels.get(iface["switch"], iface["switch"]),
+                          self.subnet(iface, family))
+                         for iface in members if family in iface)
+        total = sum(groups.values())
+        return (sum(count * (count - 1) for count in groups.values()),
+                total * (total - 1))
+
+
+    def report_reachability(self):
+        """ Reports the expected reachability for each vlan and family with all
+            core links up """
+        labels = self.graph.components()
+        for vlan, members in self.vlans.items():
+            for family in FAMILIES:
+                reachable, total = self.reachable_pairs(members, family, labels)
+                if not total:
+                    continue
+                info(f"Vlan {vlan} {family}: {reachable}/{total} pairs "
+                     "expected to be reachable\n")
+                if reachable < total:
+                    self.problem(f"Vlan {vlan} has {family} members that "
+                                 "can't reach each other")
+
+
+    def report_link_failures(self):
+        """ Reports the pairs that are expected to lose reachability when each
+            core link is down. Only bridges can partition the network """
+        base = self.graph.components()
+        for link in self.graph.links:
+            edge = self.graph.edge(link[0], link[2])
+            if edge not in self.graph.bridges:
+                continue
+            labels = self.graph.components([(link[0], link[2])])
+            for vlan, members in self.vlans.items():
+                for family in FAMILIES:
+                    before, _ = self.reachable_pairs(members, family, base)
+                    after, _ = self.reachable_pairs(members, family, labels)
+                    if after < before:
+                        warn(f"Vlan {vlan} {family}: {before - after} pairs "
+                             f"lose reachability when the link between "
+                             f"{link[0]} and {link[2]} is down\n")
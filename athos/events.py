@@ -0,0 +1,72 @@
+""" Structured event stream
+
+Writes what happens during a run as newline delimited JSON, one object per
+event, so that tools reading the results don't need to scrape the console
+output. Every event has the time it was emitted in "ts" and its type in
+"event":
+
+    {"ts": 1700000000.0, "event": "run_start", "topology": "..."}
+    {"ts": ..., "event": "topology", "members": 12, "digest": "..."}
+    {"ts": ..., "event": "phase_start", "phase": "baseline"}
+    {"ts": ..., "event": "pair", "family": "ipv4", "vlan": "100",
+     "src": "h1-eth0", "dst": "h2-eth0", "sent": 1, "received": 1,
+     "transient": null}
+    {"ts": ..., "event": "sweep", "family": "ipv4", "sent": 2,
+     "received": 2, "loss": 0.0, "transient": 0}
+    {"ts": ..., "event": "phase_end", "phase": "baseline", "wall": 1.2}
+    {"ts": ..., "event": "link", "src": "s1", "dst": "s2", "status": "down"}
+    {"ts": ..., "event": "verdict", "passed": true, "ipv4": 0.0,
+     "ipv6": 0.0, "threshold": 5, "context": "..."}
+    {"ts": ..., "event": "run_end", "passed": true}
+
+Pairs that lost packets and were retried have "transient" set to whether the
+retry got every reply, and keep the counts of their first probe. The "loss" of
+a sweep only counts the pairs whose failures persisted, while "transient" gives
+the amount of pairs that recovered on the retry.
+
+Events are written and flushed as they happen, so the stream can be followed
+while ATHOS is still running """
+
+import json
+import threading
+import time
+
+
+class EventStream():
+    """ Writes events to a file as they happen. Events can be emitted from
+        several threads at once. """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w")
+        self.lock = threading.Lock()
+
+
+    def emit(self, event, **fields):
+        """ Writes an event along with its fields """
+        line = json.dumps(dict(ts=round(time.time(), 6), event=event,
+                               **fields))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(line + "\n")
+            self.file.flush()
+
+
+    def close(self):
+        """ Closes the stream, any later events are dropped """
+        with self.lock:
+            self.file.close()
+
+
+def read_events(path):
+    """ Yields the events from a stream one at a time, skipping lines that
+        aren't complete events such as one cut short by ATHOS being killed """
+    with open(path) as stream:
+        for line in stream:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(event, dict) and "event" in event:
+                yield event
@@ -0,0 +1,198 @@
+""" Switch topology graph
+
+Builds an undirected graph of the switches from the link matrix, which is
+used to work out which core links can be turned off without partitioning the
+network """
+
+from collections import deque
+
+
+class SwitchGraph():
+    """ Undirected graph of switches and the core links between them.
+
+        Mininet's configLinkStatus changes every link between two switches at
+        once, so parallel links between the same switches are merged into a
+        single edge. The first link found for each pair of switches is kept in
+        links, in the same order as the link matrix. """
+
+    def __init__(self, link_matrix, switches=()):
+        self.adjacency = {switch: set() for switch in switches}
+        self.links = []
+        for link in link_matrix:
+            src_switch, dst_switch = link[0], link[2]
+            if src_switch == dst_switch:
+                continue
+            self.adjacency.setdefault(src_switch, set())
+            self.adjacency.setdefault(dst_switch, set())
+            if dst_switch in self.adjacency[src_switch]:
+                continue
+            self.adjacency[src_switch].add(dst_switch)
+            self.adjacency[dst_switch].add(src_switch)
+            self.links.append(link)
+        self.bridges, self.articulation_points = self.cut_elements()
+        self.distance_cache = {}
+        self.tree_parent = None
+
+
+    @staticmethod
+    def edge(src_switch, dst_switch):
+        """ Order independent key for the edge between two switches """
+        return frozenset((src_switch, dst_switch))
+
+
+    def cut_elements(self):
+        """ Finds the bridges and articulation points of the graph in linear
+            time using Tarjan's algorithm. Returns the set of bridge edges and
+            the set of articulation points """
+        index = {}
+        low = {}
+        bridges = set()
+        points = set()
+        for root in self.adjacency:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            root_children = 0
+            stack = [(root, None, iter(sorted(self.adjacency[root])))]
+            while stack:
+                node, parent, neighbours = stack[-1]
+                for neighbour in neighbours:
+                    if neighbour == parent:
+                        continue
+                    if neighbour in index:
+                        low[node] = min(low[node], index[neighbour])
+                        continue
+                    index[neighbour] = low[neighbour] = len(index)
+                    stack.append((neighbour, node,
+                                  iter(sorted(self.adjacency[neighbour]))))
+                    break
+                else:
+                    stack.pop()
+                    if parent is None:
+                        continue
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] > index[parent]:
+                        bridges.add(self.edge(parent, node))
+                    if parent == root:
+                        root_children += 1
+                    elif low[node] >= index[parent]:
+                        points.add(parent)
+            if root_children > 1:
+                points.add(root)
+        return bridges, points
+
+
+    def components(self, removed_edges=(), removed_switches=()):
+        """ Labels each switch with the connected component it belongs to once
+            the given edges and switches have been removed """
+        removed_edges = {self.edge(*edge) for edge in removed_edges}
+        removed_switches = set(removed_switches)
+        labels = {}
+        for start in self.adjacency:
+            if start in labels or start in removed_switches:
+                continue
+            labels[start] = start
+            queue = deque([start])
+            while queue:
+                node = queue.popleft()
+                for neighbour in self.adjacency[node]:
+                    if neighbour in labels or neighbour in removed_switches:
+                        continue
+                    if self.edge(node, neighbour) in removed_edges:
+                        continue
+                    labels[neighbour] = start
+                    queue.append(neighbour)
+        return labels
+
+
+    def connected(self, switches, removed_edges=(), removed_switches=()):
+        """ Checks that all of the switches can still reach each other once the
+            given edges and switches have been removed """
+        switches = set(switches) - set(removed_switches)
+        if len(switches) < 2:
+            return True
+        labels = self.components(removed_edges, removed_switches)
+        return len({labels.get(switch, switch) for switch in switches}) == 1
+
+
+    def distances(self, start):
+        """ Hop counts from the switch to every switch it can reach """
+        if start in self.distance_cache:
+            return self.distance_cache[start]
+        dist = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for neighbour in self.adjacency.get(node, ()):
+                if neighbour not in dist:
+                    dist[neighbour] = dist[node] + 1
+                    queue.append(neighbour)
+        self.distance_cache[start] = dist
+        return dist
+
+
+    def spanning_tree(self):
+        """ Breadth first spanning tree of each component, rooted at the lowest
+            named switch. Returns the parent of each switch """
+        if self.tree_parent is None:
+            self.tree_parent = {}
+            for root in sorted(self.adjacency):
+                if root in self.tree_parent:
+                    continue
+                self.tree_parent[root] = None
+                queue = deque([root])
+                while queue:
+                    node = queue.popleft()
+                    for neighbour in sorted(self.adjacency[node]):
+                        if neighbour not in self.tree_parent:
+                            self.tree_parent[neighbour] = node
+                            queue.append(neighbour)
+        return self.tree_parent
+
+
+    def on_shortest_path(self, src_switch, dst_switch, edge_a, edge_b):
+        """ Checks if the edge lies on any of the shortest paths between the
+            two switches """
+        dist_src = self.distances(src_switch)
+        dist_dst = self.distances(dst_switch)
+        if dst_switch not in dist_src or edge_a not in dist_src:
+            return False
+        return dist_src[dst_switch] in (
+            dist_src[edge_a] + 1 + dist_dst[edge_b],
+            dist_src[edge_b] + 1 + dist_dst[edge_a])
+
+
+    def on_tree_path(self, src_switch, dst_switch, edge_a, edge_b):
+        """ Checks if the edge lies on the spanning tree path between the two
+            switches, which is the case when exactly one of them sits below
+            the edge in the tree """
+        parent = self.spanning_tree()
+        if parent.get(edge_b) == edge_a:
+            child = edge_b
+        elif parent.get(edge_a) == edge_b:
+            child = edge_a
+        else:
+            return False
+
+        def below(switch):
+            while switch is not None:
+                if switch == child:
+                    return True
+                switch = parent.get(switch)
+            return False
+
+        return below(src_switch) != below(dst_switch)
+
+
+    def crossing_pairs(self, edge_a, edge_b, switches):
+        """ Finds the pairs of switches whose traffic could cross the edge,
+            either over a shortest path or over the spanning tree """
+        switches = sorted(set(switches))
+        pairs = set()
+        for i, src_switch in enumerate(switches):
+            for dst_switch in switches[i + 1:]:
+                if self.on_shortest_path(src_switch, dst_switch,
+                                         edge_a, edge_b) or \
+                   self.on_tree_path(src_switch, dst_switch, edge_a, edge_b):
+                    pairs.add(self.edge(src_switch, dst_switch))
+        return pairs
@@ -0,0 +1,90 @@
+""" Incremental testing support
+
+Keeps track of the members tested in the last successful run, so that a new
+topology can be compared against it member by member. Only the members that
+were added, removed or changed then need to be rebuilt and retested """
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import namedtuple
+from mininet.log import debug, warn
+
+
+LAST_RUN_FILE = "last_run.json"
+STATE_FIELDS = ("switch_digest", "member_digests", "port_ids")
+
+
+class MemberDiff(namedtuple("MemberDiff", ["added", "removed", "changed"])):
+    """ Names of the members that differ between two topologies """
+
+    @property
+    def affected(self):
+        """ Members that exist in the new topology and need to be retested """
+        return self.added | self.changed
+
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+
+def config_digest(config):
+    """ Stable digest of part of the topology config """
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()
+                          ).hexdigest()
+
+
+def member_digests(hosts_matrix):
+    """ Digests of each member's config, keyed by the member name """
+    return {host["name"]: config_digest(host) for host in hosts_matrix}
+
+
+def diff_members(old_digests, new_digests):
+    """ Compares the member digests of two topologies """
+    old_names = set(old_digests)
+    new_names = set(new_digests)
+    changed = {name for name in old_names & new_names
+               if old_digests[name] != new_digests[name]}
+    return MemberDiff(new_names - old_names, old_names - new_names, changed)
+
+
+def port_key(iface):
+    """ Key for the namespace of an interface, being its member and the
+        switch port it is attached to """
+    return f"{iface['name']}|{iface['switch']}|{iface['swport']}"
+
+
+def load_last_run(state_dir):
+    """ Loads the state saved by the last successful run, if any """
+    path = os.path.join(state_dir, LAST_RUN_FILE)
+    try:
+        with open(path) as state_file:
+            state = json.load(state_file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as err:
+        warn(f"Ignoring unreadable last run state {path}: {err}\n")
+        return None
+    if not isinstance(state, dict) or \
+       any(field not in state for field in STATE_FIELDS):
+        warn(f"Ignoring incomplete last run state {path}\n")
+        return None
+    return state
+
+
+def store_last_run(state_dir, state):
+    """ Atomically saves the state of a successful run """
+    tmp_path = None
+    try:
+        os.makedirs(state_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=state_dir, suffix=".tmp",
+                                         delete=False) as tmp_file:
+            tmp_path = tmp_file.name
+            json.dump({field: state[field] for field in STATE_FIELDS},
+                      tmp_file)
+        os.replace(tmp_path, os.path.join(state_dir, LAST_RUN_FILE))
+    except OSError as err:
+        debug(f"Unable to save the last run state to {state_dir}: {err}\n")
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
@@ -0,0 +1,140 @@
+""" Round trip time capture
+
+Keeps the RTT of every probe reply, grouped into the phases of a run (the
+baseline and each link being set down or up), and summarises them as
+percentiles per phase, vlan and pair. Pairs whose latency goes up after a
+link event are flagged, as this points at traffic taking a longer path """
+
+import json
+import math
+import re
+import threading
+from array import array
+
+
+PERCENTILES = (50, 95, 99)
+BASELINE_PHASE = "baseline"
+REGRESSION_FACTOR = 2.0 # Times the baseline median before flagging a pair
+REGRESSION_MIN_DELTA = 1.0 # Smallest increase in ms that gets flagged
+RTT_PATTERN = re.compile(r"time[=<]([\d.]+) ms")
+
+
+def parse_rtts(ping_output):
+    """ Extracts the RTT in ms of each reply from the output of ping """
+    return [float(rtt) for rtt in RTT_PATTERN.findall(ping_output)]
+
+
+def percentiles(values):
+    """ Nearest rank percentiles of the values, along with their count """
+    values = sorted(values)
+    summary = {"count": len(values)}
+    for pct in PERCENTILES:
+        rank = max(1, math.ceil(pct / 100 * len(values)))
+        summary[f"p{pct}"] = round(values[rank - 1], 3) if values else None
+    return summary
+
+
+class RttStore():
+    """ Array backed store of RTT samples.
+
+        Each pair is given an index the first time it is seen. Every phase
+        keeps two parallel arrays, one with the pair index of each sample and
+        one with the RTT in ms, so millions of samples stay compact. Samples
+        can be recorded from several threads at once. """
+
+    def __init__(self):
+        self.pairs = {}
+        self.labels = []
+        self.phases = {}
+        self.current = BASELINE_PHASE
+        self.lock = threading.Lock()
+
+
+    def begin(self, phase):
+        """ Records the following samples as part of the phase """
+        self.current = phase
+
+
+    def record(self, family, vlan, host, dst, rtts):
+        """ Records the RTTs of the replies from dst to pings sent by host """
+        if not rtts:
+            return
+        key = (family, str(vlan), host["id"], dst["id"])
+        with self.lock:
+            index = self.pairs.get(key)
+            if index is None:
+                index = self.pairs[key] = len(self.labels)
+                self.labels.append({
+                    "family": family, "vlan": str(vlan),
+                    "src": host["name"], "src_host": f"h{host['id']}",
+                    "dst": dst["name"], "dst_host": f"h{dst['id']}"
+                })
+            indexes, samples = self.phases.setdefault(
+                self.current, (array("I"), array("f")))
+            indexes.extend([index] * len(rtts))
+            samples.extend(rtts)
+
+
+    def by_pair(self, phase):
+        """ Groups the samples of the phase by pair index """
+        pairs = {}
+        indexes, samples = self.phases.get(phase, ((), ()))
+        for index, rtt in zip(indexes, samples):
+            pairs.setdefault(index, []).append(rtt)
+        return pairs
+
+
+    def summary(self, phase):
+        """ Percentiles of the phase overall, per family and vlan, and per
+            pair """
+        pairs = self.by_pair(phase)
+        vlans = {}
+        for index, rtts in pairs.items():
+            label = self.labels[index]
+            vlans.setdefault(f"{label['family']} {label['vlan']}",
+                             []).extend(rtts)
+        return {
+            "all": percentiles(self.phases[phase][1]),
+            "vlans": {vlan: percentiles(rtts) for vlan, rtts in vlans.items()},
+            "pairs": {index: percentiles(rtts)
+                      for index, rtts in pairs.items()}
+        }
+
+
+    def regressions(self, factor=REGRESSION_FACTOR,
+                    min_delta=REGRESSION_MIN_DELTA):
+        """ Finds the pairs whose median RTT in a later phase is at least
+            factor times, and min_delta ms more than, their baseline median.
+            Returns (phase, pair label, baseline p50, phase p50) tuples """
+        if BASELINE_PHASE not in self.phases:
+            return []
+        baseline = {index: percentiles(rtts)["p50"]
+                    for index, rtts in self.by_pair(BASELINE_PHASE).items()}
+        found = []
+        for phase in self.phases:
+            if phase == BASELINE_PHASE:
+                continue
+            for index, rtts in self.by_pair(phase).items():
+                if index not in baseline:
+                    continue
+                before = baseline[index]
+                after = percentiles(rtts)["p50"]
+                if after >= before * factor and after - before >= min_delta:
+                    found.append((phase, self.labels[index], before, after))
+        return found
+
+
+    def to_json(self, path):
+        """ Writes the percentiles of every phase, vlan and pair, along with
+            the regressions found """
+        report = {"phases": {}, "regressions": []}
+        for phase in self.phases:
+            summary = self.summary(phase)
+            summary["pairs"] = [dict(self.labels[index], **pct)
+                                for index, pct in summary["pairs"].items()]
+            report["phases"][phase] = summary
+        for phase, label, before, after in self.regressions():
+            report["regressions"].append(
+                dict(label, phase=phase, baseline_p50=before, p50=after))
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=1)
@@ -1,8 +1,20 @@
-""" Logging function for Topology tester """
+""" Logging function for Topology tester
 
+Log files are written from a background thread. Records are put on a queue by
+the logging calls, and a listener thread writes them to the files through a
+buffer that is flushed once it fills up, once a second, and straight away for
+errors. The queues are drained and the buffers flushed when the program exits,
+including when it is stopped with SIGTERM """
+
+import atexit
 import logging
+import queue
+import signal
+import threading
+import time
 import types
 from logging import FileHandler, Formatter, Logger, StreamHandler, debug
+from logging.handlers import QueueHandler, QueueListener
 from mininet.log import StreamHandlerNoNewline, lg, setLogLevel
 
 
@@ -10,6 +22,10 @@ DEFAULT_LOG_PATH = "/var/log/athos"
 DEFAULT_LOG_FILE = DEFAULT_LOG_PATH + "/athos.log"
 DEFAULT_MN_LOG_FILE = DEFAULT_LOG_PATH + "/mininet.log"
 LOGMSGFORMAT = '%(asctime)s %(name)s %(levelname)s %(message)s'
+LOG_BUFFER_SIZE = 64 * 1024 # Bytes buffered before a log file is written
+LOG_FLUSH_INTERVAL = 1.0 # Longest time in seconds a record stays buffered
+
+listeners = []
 
 LEVELS = {  'debug': logging.DEBUG,
             'info': logging.INFO,
@@ -31,7 +47,7 @@ def get_logger(log_level='info', logname='athos',
 
     logger = logging.getLogger(logname)
 
-    logger_fhandler = logging.FileHandler(log_file)
+    logger_fhandler = BufferedFileHandler(log_file)
 
     logger_fhandler.setFormatter(
         logging.Formatter(LOGMSGFORMAT, '%b %d %H:%M:%S'))
@@ -55,30 +71,118 @@ def set_mininet_log_file(log_level='info', console=True,
             h for h in lg.handlers if not isinstance(h, StreamHandlerNoNewline)]
 
 
-class FileHandlerNoNewLine(logging.FileHandler ):
+def start_queue_logging(loggers=None):
+    """ Moves the file handlers of the loggers, by default the root and
+        mininet loggers, behind queues written by background threads. The
+        queues are drained when the program exits or receives SIGTERM """
+    if loggers is None:
+        loggers = [logging.getLogger(), lg]
+    for logger in loggers:
+        handlers = [h for h in logger.handlers if isinstance(h, FileHandler)]
+        if not handlers:
+            continue
+        log_queue = queue.SimpleQueue()
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(LocalQueueHandler(log_queue))
+        listener = BufferedQueueListener(log_queue, *handlers,
+                                         respect_handler_level=True)
+        listener.start()
+        listeners.append(listener)
+    if listeners and threading.current_thread() is threading.main_thread():
+        atexit.register(stop_queue_logging)
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, exit_on_sigterm)
+
+
+def stop_queue_logging():
+    """ Writes out the queued records and flushes the log files """
+    while listeners:
+        listeners.pop().stop()
+
+
+def exit_on_sigterm(signum, _frame):
+    """ Exits through the normal shutdown path, so that the queued log
+        records are written out """
+    raise SystemExit(128 + signum)
+
+
+class LocalQueueHandler(QueueHandler):
+    """ Queue handler for a listener within the same process. Records are
+        queued as they are and formatted by the listener, rather than being
+        formatted and copied by the thread that logged them """
+
+    def prepare(self, record):
+        return record
+
+
+class BufferedQueueListener(QueueListener):
+    """ Queue listener that flushes its handlers whenever the queue has been
+        idle for the flush interval """
+
+    def __init__(self, log_queue, *handlers, respect_handler_level=False,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        super().__init__(log_queue, *handlers,
+                         respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+    def stop(self):
+        super().stop()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """ FileHandler that buffers what it writes instead of flushing after
+        every record. The buffer is written once it holds buffer_size bytes,
+        and flushed when a record comes in after the flush interval or is an
+        error. Behind a queue, the listener also flushes it whenever the queue
+        goes idle """
+
+    def __init__(self, filename, mode='a', encoding=None,
+                 buffer_size=LOG_BUFFER_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        super().__init__(filename, mode, encoding)
+
+    def _open(self):
+        # FileHandler only has errors from Python 3.9
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                    encoding=self.encoding,
+                    errors=getattr(self, "errors", None))
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            self.stream.write(msg + self.terminator)
+            if record.levelno >= logging.ERROR or \
+               time.monotonic() - self.last_flush >= self.flush_interval:
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        super().flush()
+        self.last_flush = time.monotonic()
+
+
+class FileHandlerNoNewLine(BufferedFileHandler):
     """ FileHandler that doesn't print newlines by default
         This is to make the logging work better with the way that mininet logs
         to the console, and we can get all those logs in a file """
 
-    def emit( self, record ):
-        """Emit a record.
-           If a formatter is specified, it is used to format the record.
-           The record is then written to the stream with a trailing newline
-           [ N.B. this may be removed depending on feedback ]. If exception
-           information is present, it is formatted using
-           traceback.printException and appended to the stream."""
-        try:
-            msg = self.format( record )
-            fs = '%s'  # was '%s\n'
-            if not hasattr( types, 'UnicodeType' ):  # if no unicode support...
-                self.stream.write( fs % msg )
-            else:
-                try:
-                    self.stream.write( fs % msg )
-                except UnicodeError:
-                    self.stream.write( fs % msg.encode( 'UTF-8' ) )
-            self.flush()
-        except ( KeyboardInterrupt, SystemExit ):
-            raise
-        except:
-            self.handleError( record )
\ No newline at end of file
+    terminator = ''
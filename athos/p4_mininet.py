@@ -19,9 +19,14 @@ from mininet.node import Switch, Host
 from mininet.log import setLogLevel, info, error, debug
 from mininet.moduledeps import pathCheck
 from sys import exit
+import errno
 import os
+import select
 import tempfile
 import socket
+import time
+
+DEFAULT_START_TIMEOUT = 30 # Seconds to wait for the Thrift server to start
 
 class P4Host(Host):
     def config(self, **params):
@@ -87,27 +92,29 @@ class P4Switch(Switch):
             self.device_id = P4Switch.device_id
             P4Switch.device_id += 1
         self.nanomsg = "ipc:///tmp/bm-{}-log.ipc".format(self.device_id)
+        self.sw_pid = None
+        self.start_time = None
 
     @classmethod
     def setup(cls):
         pass
 
-    def check_switch_started(self, pid):
-        """While the process is running (pid exists), we check if the Thrift
-        server has been started. If the Thrift server is ready, we assume that
-        the switch was started successfully. This is only reliable if the Thrift
-        server is started at the end of the init process"""
-        while True:
-            if not os.path.exists(os.path.join("/proc", str(pid))):
-                return False
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            try:
-                sock.settimeout(0.5)
-                result = sock.connect_ex(("localhost", self.thrift_port))
-            finally:
-                sock.close()
-            if result == 0:
-                return  True
+    @classmethod
+    def batchStartup(cls, switches):
+        """Called by mininet once all switches have been started. The P4
+        switches are launched without waiting for them, so we wait for all of
+        them to be ready here"""
+        started = wait_for_thrift(switches)
+        for switch in switches:
+            if switch not in started:
+                error("P4 switch {} did not start correctly.\n".format(
+                    switch.name))
+                exit(1)
+        return started
+
+    def is_running(self):
+        """Checks if the simple_switch process is still running"""
+        return os.path.exists(os.path.join("/proc", str(self.sw_pid)))
 
     def start(self, controllers):
         "Start up a new P4 switch"
@@ -139,10 +146,8 @@ class P4Switch(Switch):
             self.cmd(' '.join(args) + ' >' + logfile + ' 2>&1 & echo $! >> ' + f.name)
             pid = int(f.read())
         debug("P4 switch {} PID is {}.\n".format(self.name, pid))
-        if not self.check_switch_started(pid):
-            error("P4 switch {} did not start correctly.\n".format(self.name))
-            exit(1)
-        info("P4 switch {} has been started.\n".format(self.name))
+        self.sw_pid = pid
+        self.start_time = time.monotonic()
 
     def stop(self):
         "Terminate P4 switch."
@@ -158,3 +163,53 @@ class P4Switch(Switch):
     def detach(self, intf):
         "Disconnect a data port"
         assert(0)
+
+
+def wait_for_thrift(switches, timeout=DEFAULT_START_TIMEOUT):
+    """While the processes are running, we check if their Thrift servers have
+    been started. If the Thrift server is ready, we assume that the switch was
+    started successfully. This is only reliable if the Thrift server is started
+    at the end of the init process. All pending switches are checked at once,
+    backing off between rounds. Returns the switches that have started"""
+    pending = list(switches)
+    started = []
+    delay = 0.01
+    deadline = time.monotonic() + timeout
+    while pending:
+        connecting = {}
+        for switch in list(pending):
+            if not switch.is_running():
+                pending.remove(switch)
+                continue
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            result = sock.connect_ex(("localhost", switch.thrift_port))
+            if result in (errno.EINPROGRESS, errno.EAGAIN):
+                connecting[sock] = switch
+                continue
+            sock.close()
+            if result == 0:
+                pending.remove(switch)
+                started.append(switch)
+        if connecting:
+            _, writable, _ = select.select([], list(connecting), [], delay)
+            for sock in writable:
+                if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0:
+                    pending.remove(connecting[sock])
+                    started.append(connecting[sock])
+            for sock in connecting:
+                sock.close()
+        for switch in started:
+            if switch.start_time is not None:
+                info("P4 switch {} has been started in {:.2f}s.\n".format(
+                    switch.name, time.monotonic() - switch.start_time))
+                switch.start_time = None
+        if not pending:
+            break
+        if time.monotonic() > deadline:
+            error("Timed out waiting for P4 switches: {}\n".format(
+                " ".join(switch.name for switch in pending)))
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+    return started
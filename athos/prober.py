@@ -0,0 +1,206 @@
+""" In-process ICMP prober
+
+Sends ICMP and ICMPv6 echo requests from raw sockets opened inside each host's
+network namespace. This avoids forking a ping process for every pair and
+having to parse its output """
+
+import asyncio
+import ctypes
+import ctypes.util
+import itertools
+import os
+import socket
+import struct
+import time
+from collections import namedtuple
+
+
+CLONE_NEWNET = 0x40000000
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+PAYLOAD = bytes(range(56))
+DEFAULT_TIMEOUT = 1 # Seconds to wait for the last reply, same as ping -W 1
+DEFAULT_INTERVAL = 0.01 # Seconds between requests, same as ping -i 0.01
+
+# transient is only set on pairs that lost packets and were retried: True when
+# the retry got every reply, False when it lost packets again
+ProbeResult = namedtuple("ProbeResult", ["sent", "received", "rtts",
+                                         "transient"], defaults=(None,))
+
+
+def setns(fd):
+    """ Moves the calling thread into the network namespace of fd """
+    if hasattr(os, "setns"):
+        os.setns(fd, CLONE_NEWNET)
+        return
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if libc.setns(fd, CLONE_NEWNET) != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def checksum(data):
+    """ Calculates the internet checksum used by ICMP """
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def echo_request(family, ident, seq):
+    """ Builds an ICMP or ICMPv6 echo request. The kernel fills in the
+        checksum for ICMPv6 """
+    if family == "ipv4":
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+        header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0,
+                             checksum(header + PAYLOAD), ident, seq)
+    else:
+        header = struct.pack("!BBHHH", ICMPV6_ECHO_REQUEST, 0, 0, ident, seq)
+    return header + PAYLOAD
+
+
+def parse_echo_reply(family, data):
+    """ Returns the (identifier, sequence) of an echo reply, or None if the
+        packet is something else. IPv4 raw sockets include the IP header """
+    if family == "ipv4":
+        data = data[(data[0] & 0x0f) * 4:]
+        reply_type = ICMP_ECHO_REPLY
+    else:
+        reply_type = ICMPV6_ECHO_REPLY
+    if len(data) < 8:
+        return None
+    icmp_type, _, _, ident, seq = struct.unpack("!BBHHH", data[:8])
+    if icmp_type != reply_type:
+        return None
+    return ident, seq
+
+
+class IcmpProber():
+    """ Raw socket ICMP prober.
+
+        Opens one socket per host interface inside the host's namespace, and
+        drives the echo requests to all destinations with asyncio. Sockets keep
+        the namespace they were created in, so the calling thread only needs to
+        enter the namespace while opening them. """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, interval=DEFAULT_INTERVAL,
+                 concurrency=None):
+        self.timeout = timeout
+        self.interval = interval
+        self.concurrency = concurrency
+        self.sockets = {}
+        self.idents = itertools.cycle(range(1, 0x10000))
+
+
+    def open_socket(self, pid, family, interface):
+        """ Opens a raw socket in the network namespace of the pid, bound to
+            the interface. Sockets are reused between sweeps """
+        key = (pid, family, interface)
+        if key in self.sockets:
+            return self.sockets[key]
+        own_ns = os.open("/proc/thread-self/ns/net", os.O_RDONLY)
+        host_ns = os.open(f"/proc/{pid}/ns/net", os.O_RDONLY)
+        try:
+            setns(host_ns)
+            try:
+                if family == "ipv4":
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                         socket.IPPROTO_ICMP)
+                else:
+                    sock = socket.socket(socket.AF_INET6, socket.SOCK_RAW,
+                                         socket.IPPROTO_ICMPV6)
+                sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE,
+                                interface.encode())
+            finally:
+                setns(own_ns)
+        finally:
+            os.close(own_ns)
+            os.close(host_ns)
+        sock.setblocking(False)
+        self.sockets[key] = sock
+        return sock
+
+
+    def probe(self, pairs, count=1):
+        """ Probes each (pid, interface, family, address) pair count times.
+            Returns a ProbeResult for each pair, in the same order """
+        probes = [(self.open_socket(pid, family, iface), family, addr)
+                  for pid, iface, family, addr in pairs]
+        return asyncio.run(self._probe_all(probes, count))
+
+
+    def forget(self, pid):
+        """ Closes the sockets opened within the namespace of the pid, for
+            when its host is removed. A later host that reuses the pid gets
+            new sockets in its own namespace """
+        for key in [key for key in self.sockets if key[0] == pid]:
+            self.sockets.pop(key).close()
+
+
+    def close(self):
+        """ Closes all of the opened sockets """
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets = {}
+
+
+    async def _probe_all(self, probes, count):
+        loop = asyncio.get_running_loop()
+        limit = asyncio.Semaphore(self.concurrency or max(len(probes), 1))
+        pending = {}
+        readers = {sock: family for sock, family, _ in probes}
+        for sock, family in readers.items():
+            loop.add_reader(sock, self._read_replies, sock, family, pending)
+        try:
+            return await asyncio.gather(
+                *(self._probe(limit, pending, sock, family, addr, count)
+                  for sock, family, addr in probes))
+        finally:
+            for sock in readers:
+                loop.remove_reader(sock)
+
+
+    async def _probe(self, limit, pending, sock, family, addr, count):
+        loop = asyncio.get_running_loop()
+        sockaddr = (addr, 0) if family == "ipv4" else (addr, 0, 0, 0)
+        async with limit:
+            ident = next(self.idents)
+            replies = []
+            for seq in range(1, count + 1):
+                if seq > 1:
+                    await asyncio.sleep(self.interval)
+                reply = loop.create_future()
+                pending[(sock, ident, seq)] = (time.perf_counter(), reply)
+                try:
+                    sock.sendto(echo_request(family, ident, seq), sockaddr)
+                except OSError:
+                    reply.set_result(None)
+                replies.append(reply)
+            await asyncio.wait(replies, timeout=self.timeout)
+            for seq in range(1, count + 1):
+                pending.pop((sock, ident, seq), None)
+            rtts = [reply.result() for reply in replies
+                    if reply.done() and reply.result() is not None]
+            return ProbeResult(count, len(rtts), rtts)
+
+
+    def _read_replies(self, sock, family, pending):
+        """ Drains the socket and resolves the matching pending requests with
+            their round trip time in milliseconds """
+        while True:
+            try:
+                data = sock.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            received = time.perf_counter()
+            reply = parse_echo_reply(family, data)
+            if not reply:
+                continue
+            sent, future = pending.get((sock, *reply), (None, None))
+            if future and not future.done():
+                future.set_result((received - sent) * 1000.0)
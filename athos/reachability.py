@@ -0,0 +1,189 @@
+""" Reachability matrices
+
+Records which pairs could reach each other in every phase of a run, as a
+bit matrix for each address family and vlan. Bit src * size + dst is set when
+the interface with the src index reached the one with the dst index, and a
+second matrix marks the pairs that were tested at all, so that pairs left out
+of a sweep aren't mistaken for broken ones.
+
+The matrices are kept as bytearrays while a sweep fills them in, and compared
+as Python ints, so working out which pairs broke between two phases is a
+handful of big integer operations whatever the amount of interfaces """
+
+import json
+import re
+import threading
+
+
+NONZERO_BYTE = re.compile(b"[^\x00]")
+
+
+class ReachabilityMatrix():
+    """ Reachability between the interfaces of a vlan for one address
+        family, indexed by the interface ids """
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        self.index = {iface_id: i for i, iface_id in enumerate(self.ids)}
+        self.size = len(self.ids)
+        length = (self.size * self.size + 7) // 8
+        self.reached = bytearray(length)
+        self.tested = bytearray(length)
+        self.cached = None
+
+
+    def mark(self, src_id, dst_id, reached):
+        """ Records the result of the pair """
+        bit = self.index[src_id] * self.size + self.index[dst_id]
+        self.cached = None
+        self.tested[bit >> 3] |= 1 << (bit & 7)
+        if reached:
+            self.reached[bit >> 3] |= 1 << (bit & 7)
+
+
+    def bits(self):
+        """ Returns the reached and tested matrices as ints, which are kept
+            until the matrix changes """
+        if self.cached is None:
+            self.cached = (int.from_bytes(self.reached, "little"),
+                           int.from_bytes(self.tested, "little"))
+        return self.cached
+
+
+    def pairs(self, bits):
+        """ Lists the (src id, dst id) pairs of the bits that are set """
+        data = bits.to_bytes(len(self.reached), "little")
+        pairs = []
+        for match in NONZERO_BYTE.finditer(data):
+            byte = match.start()
+            value = data[byte]
+            for offset in range(8):
+                if value >> offset & 1:
+                    src, dst = divmod(byte * 8 + offset, self.size)
+                    pairs.append((self.ids[src], self.ids[dst]))
+        return pairs
+
+
+    def diff(self, after):
+        """ Compares with the matrix of a later phase. Returns the bits of the
+            pairs that broke and that were restored, out of those tested in
+            both phases """
+        if after.ids != self.ids:
+            raise ValueError("Matrices are indexed by different interfaces")
+        reached, tested = self.bits()
+        after_reached, after_tested = after.bits()
+        both = tested & after_tested
+        return (reached & ~after_reached & both,
+                after_reached & ~reached & both)
+
+
+    def to_json(self):
+        """ Encodes the matrix with the bits as hex strings """
+        reached, tested = self.bits()
+        return {"ids": self.ids, "reached": f"{reached:x}",
+                "tested": f"{tested:x}"}
+
+
+    @classmethod
+    def from_json(cls, data):
+        """ Decodes a matrix encoded by to_json """
+        matrix = cls(data["ids"])
+        length = len(matrix.reached)
+        matrix.reached[:] = int(data["reached"], 16).to_bytes(length, "little")
+        matrix.tested[:] = int(data["tested"], 16).to_bytes(length, "little")
+        return matrix
+
+
+class ReachabilityStore():
+    """ Reachability matrices of each phase of a run, keyed by address family
+        and vlan within each phase. Sweeps of both families can be recorded
+        at once. """
+
+    def __init__(self):
+        self.phases = {}
+        self.current = "baseline"
+        self.lock = threading.Lock()
+
+
+    def begin(self, phase):
+        """ Records the following sweeps as part of the phase """
+        self.current = phase
+
+
+    def record(self, family, plan, results, members=None):
+        """ Records the results of a sweep for each vlan of the plan. members
+            gives the ids of every interface in each vlan, so that sweeps of
+            part of a vlan are indexed the same way as full ones """
+        results = iter(results)
+        members = members or {}
+        for vlan, sources in plan:
+            ids = set(members.get(vlan, ()))
+            ids.update(host["id"] for host, _ in sources)
+            ids.update(dst["id"] for _, dsts in sources for dst in dsts)
+            key = f"{family} {vlan}"
+            with self.lock:
+                matrices = self.phases.setdefault(self.current, {})
+                matrix = matrices.get(key)
+                if matrix is None or not ids <= matrix.index.keys():
+                    ids.update(matrix.ids if matrix else ())
+                    matrix = self.extend(matrix, ids)
+                    matrices[key] = matrix
+            for host, dsts in sources:
+                for dst in dsts:
+                    result = next(results)
+                    matrix.mark(host["id"], dst["id"],
+                                result.received > 0 or bool(result.transient))
+
+
+    @staticmethod
+    def extend(matrix, ids):
+        """ Returns a matrix over the ids, keeping the results of the matrix
+            it replaces """
+        extended = ReachabilityMatrix(ids)
+        if matrix:
+            for bits, target in zip(matrix.bits(), ("reached", "tested")):
+                for src, dst in matrix.pairs(bits):
+                    bit = extended.index[src] * extended.size + \
+                        extended.index[dst]
+                    getattr(extended, target)[bit >> 3] |= 1 << (bit & 7)
+        return extended
+
+
+    def diff(self, before, after):
+        """ Works out the pairs that broke and were restored between two
+            phases, for each family and vlan in both. Returns a dict of
+            (broken, restored) lists of (src id, dst id) pairs """
+        changes = {}
+        for key, matrix in self.phases.get(before, {}).items():
+            later = self.phases.get(after, {}).get(key)
+            if later is None:
+                continue
+            if later.ids != matrix.ids:
+                ids = set(matrix.ids) | set(later.ids)
+                matrix, later = self.extend(matrix, ids), \
+                    self.extend(later, ids)
+            broken, restored = matrix.diff(later)
+            if broken or restored:
+                changes[key] = (matrix.pairs(broken), matrix.pairs(restored))
+        return changes
+
+
+    def to_json(self, path):
+        """ Writes the matrices of every phase """
+        with open(path, "w") as report_file:
+            json.dump({phase: {key: matrix.to_json()
+                               for key, matrix in matrices.items()}
+                       for phase, matrices in self.phases.items()},
+                      report_file)
+
+
+    @classmethod
+    def load(cls, path):
+        """ Reads the matrices written by to_json """
+        store = cls()
+        with open(path) as report_file:
+            for phase, matrices in json.load(report_file).items():
+                store.phases[phase] = {
+                    key: ReachabilityMatrix.from_json(matrix)
+                    for key, matrix in matrices.items()}
+        return store
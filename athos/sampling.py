@@ -0,0 +1,53 @@
+""" Sampled sweeps
+
+Picks a subset of the pairs within a vlan that still exercises every
+interface and every path between the switches the members are attached to.
+The number of pairs grows linearly with the members, plus a pair in each
+direction for every two switches with members in the vlan """
+
+
+def sample_pairs(members):
+    """ Returns (source, destination) indexes into members.
+
+        The members are ordered by switch and paired in a cycle, each one
+        pinging the next, so every interface is both a source and a
+        destination. Each pair of switches then gets a pair in both
+        directions, rotating through the members of each switch so the load
+        is spread between them """
+    if len(members) < 2:
+        return set()
+    order = sorted(range(len(members)),
+                   key=lambda i: (str(members[i]["switch"]), members[i]["id"]))
+    pairs = {(src, dst) for src, dst in zip(order, order[1:] + order[:1])}
+    by_switch = {}
+    for i in order:
+        by_switch.setdefault(str(members[i]["switch"]), []).append(i)
+    switches = sorted(by_switch)
+    used = {switch: 0 for switch in switches}
+
+    def next_member(switch):
+        member = by_switch[switch][used[switch] % len(by_switch[switch])]
+        used[switch] += 1
+        return member
+
+    for i, src_switch in enumerate(switches):
+        for dst_switch in switches[i + 1:]:
+            src, dst = next_member(src_switch), next_member(dst_switch)
+            pairs.add((src, dst))
+            pairs.add((dst, src))
+    return pairs
+
+
+def uncovered_links(graph, switch_pairs):
+    """ Lists the links of the graph that none of the pairs of switches could
+        send traffic over, either over a shortest path or over the spanning
+        tree """
+    switch_pairs = {graph.edge(*pair) for pair in switch_pairs
+                    if pair[0] != pair[1]}
+
+    def covered(link):
+        return any(graph.on_shortest_path(src, dst, link[0], link[2]) or
+                   graph.on_tree_path(src, dst, link[0], link[2])
+                   for src, dst in switch_pairs)
+
+    return [link for link in graph.links if not covered(link)]
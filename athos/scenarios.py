@@ -0,0 +1,167 @@
+""" Failure scenarios
+
+Plans tests where several core links, or every link of a switch, go down at
+once. Testing every combination of k links quickly becomes impractical, so
+combinations are pruned using the cuts of the switch graph:
+
+* combinations that partition the switches of a vlan would surely fail, and
+  so would every combination that contains them
+* links in a chain of switches without members are interchangeable, failing
+  any of them cuts the chain in the same way
+* links that only lead to switches without members can't change what the
+  members see, so failing them adds nothing to a combination """
+
+import math
+from collections import Counter, namedtuple
+
+
+Scenario = namedtuple("Scenario", ["name", "links", "switch"])
+
+
+class FailurePlanner():
+    """ Works out the failure scenarios worth testing for a switch graph and
+        the switches the members of each vlan are attached to.
+
+        The amount of combinations pruned for each reason is kept in pruned,
+        and the amount considered in total in considered. """
+
+    def __init__(self, graph, vlan_switches):
+        self.graph = graph
+        self.vlan_switches = {vlan: set(switches)
+                              for vlan, switches in vlan_switches.items()}
+        self.member_switches = set().union(*self.vlan_switches.values())
+        self.pruned = Counter()
+        self.considered = 0
+
+
+    def partitions(self, removed_edges=(), removed_switches=()):
+        """ Returns a vlan whose remaining switches can't all reach each other
+            once the edges and switches are removed, or None """
+        labels = self.graph.components(removed_edges, removed_switches)
+        for vlan, switches in self.vlan_switches.items():
+            switches = switches - set(removed_switches)
+            if len({labels.get(switch, switch) for switch in switches}) > 1:
+                return vlan
+        return None
+
+
+    def pass_through(self, switch):
+        """ Checks if the switch only forwards traffic along a chain """
+        return len(self.graph.adjacency[switch]) == 2 and \
+            switch not in self.member_switches
+
+
+    def irrelevant(self, link):
+        """ Checks if the link only leads to switches without members, so
+            that setting it down can't affect them """
+        edge = self.graph.edge(link[0], link[2])
+        labels = self.graph.components([edge])
+        if edge in self.graph.bridges:
+            sides = {labels[link[0]], labels[link[2]]}
+        else:
+            sides = {labels[link[0]]}
+        member_sides = {labels[switch] for switch in self.member_switches
+                        if switch in labels}
+        return not sides <= member_sides
+
+
+    def representatives(self):
+        """ Picks one link out of each chain of links joined by pass through
+            switches, leaving out the links that are irrelevant """
+        chain = {}
+        links = [link for link in self.graph.links
+                 if not self.irrelevant(link)]
+        for link in links:
+            chain[self.graph.edge(link[0], link[2])] = link
+        for switch in self.graph.adjacency:
+            if not self.pass_through(switch):
+                continue
+            edges = [self.graph.edge(switch, neighbour)
+                     for neighbour in self.graph.adjacency[switch]]
+            if not all(edge in chain for edge in edges):
+                continue
+            # Merges the two chains, keeping the link that comes first
+            first, second = sorted((chain[edge] for edge in edges),
+                                   key=links.index)
+            for edge, link in chain.items():
+                if link == second:
+                    chain[edge] = first
+        kept = {id(link) for link in chain.values()}
+        return [link for link in links if id(link) in kept]
+
+
+    def link_scenarios(self, max_links):
+        """ Lists the scenarios with two up to max_links links down at once.
+            Combinations are built up one link at a time, so that once a
+            combination partitions a vlan none of the combinations containing
+            it are built """
+        considered = sum(math.comb(len(self.graph.links), k)
+                         for k in range(2, max_links + 1))
+        self.considered += considered
+        pruned = sum(self.pruned.values())
+        links = self.representatives()
+        partitioning = []
+        scenarios = []
+
+        def extend(combo, start):
+            for i in range(start, len(links)):
+                candidate = combo + [links[i]]
+                edges = frozenset(self.graph.edge(link[0], link[2])
+                                  for link in candidate)
+                if any(cut <= edges for cut in partitioning):
+                    self.count_pruned("superset", candidate, i, links,
+                                      max_links)
+                    continue
+                if self.partitions(edges) is not None:
+                    partitioning.append(edges)
+                    self.count_pruned("partition", candidate, i, links,
+                                      max_links)
+                    continue
+                if len(candidate) > 1:
+                    scenarios.append(Scenario(
+                        "links " + ", ".join(f"{link[0]}-{link[2]}"
+                                             for link in candidate),
+                        candidate, None))
+                if len(candidate) < max_links:
+                    extend(candidate, i + 1)
+
+        extend([], 0)
+        pruned = sum(self.pruned.values()) - pruned
+        self.pruned["equivalent"] += considered - len(scenarios) - pruned
+        return scenarios
+
+
+    def count_pruned(self, reason, candidate, i, links, max_links):
+        """ Counts the combinations of at least two links that are skipped
+            along with the candidate, which are the candidate itself and the
+            ones that would have been built from it """
+        remaining = len(links) - i - 1
+        skipped = sum(math.comb(remaining, extra)
+                      for extra in range(max_links - len(candidate) + 1)
+                      if len(candidate) + extra > 1)
+        self.pruned[reason] += skipped
+
+
+    def switch_scenarios(self, switches):
+        """ Lists the scenarios where every link of a switch goes down. A
+            switch without members that only leads on to a single switch, or
+            along a chain, fails the same way as one of its links and is left
+            out """
+        scenarios = []
+        for switch in sorted(switches, key=str):
+            neighbours = self.graph.adjacency.get(switch)
+            if not neighbours:
+                continue
+            self.considered += 1
+            if switch not in self.member_switches and \
+               (len(neighbours) == 1 or self.pass_through(switch)):
+                self.pruned["equivalent"] += 1
+                continue
+            if self.partitions(removed_switches=[switch]) is not None:
+                self.pruned["partition"] += 1
+                continue
+            links = [link for link in self.graph.links
+                     if switch in (link[0], link[2])]
+            scenarios.append(Scenario(f"links of switch {switch}", links,
+                                      switch))
+        return scenarios
@@ -0,0 +1,178 @@
+""" Run time instrumentation
+
+Records the wall clock and CPU time of each phase of an ATHOS run, along with
+the latency of the commands run within each host. The CPU time of a phase is
+that of the thread it ran in, so work it hands to other threads is counted in
+their phases instead. The results can be exported as JSON, or as a Chrome
+trace event file that can be opened in chrome://tracing or Perfetto """
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+PROFILE_VERSION = 1
+
+
+class Profiler():
+    """ Records timing information for phases and host commands.
+
+        Phases can be nested, with each thread keeping track of the phase it
+        is currently in. When disabled, nothing is recorded. The start and end
+        of each phase are also sent to the event stream when one is given,
+        whether or not the profiler is enabled. """
+
+    def __init__(self, enabled=False, events=None):
+        self.enabled = enabled
+        self.events = events
+        self.started = datetime.now()
+        self.origin = time.perf_counter()
+        self.phases = []
+        self.commands = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+
+    @contextmanager
+    def phase(self, name, **details):
+        """ Times the enclosed block as a phase of the run """
+        if self.events:
+            self.events.emit("phase_start", phase=name, **details)
+        start = time.perf_counter()
+        try:
+            with self.record_phase(name, details):
+                yield
+        finally:
+            if self.events:
+                self.events.emit("phase_end", phase=name,
+                                 wall=round(time.perf_counter() - start, 6),
+                                 **details)
+
+
+    @contextmanager
+    def record_phase(self, name, details):
+        """ Records the timing of a phase when enabled """
+        if not self.enabled:
+            yield
+            return
+        stack = self.local.__dict__.setdefault("stack", [])
+        parent = stack[-1] if stack else None
+        stack.append(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            stack.pop()
+            with self.lock:
+                self.phases.append({
+                    "name": name,
+                    "parent": parent,
+                    "start": wall_start - self.origin,
+                    "wall": wall,
+                    "cpu": cpu,
+                    "thread": threading.get_ident(),
+                    "details": details
+                })
+
+
+    def inherit(self, func):
+        """ Wraps a function that runs in another thread, so that the phases
+            it records are nested within the caller's current phase """
+        if not self.enabled:
+            return func
+        stack = list(self.local.__dict__.get("stack", []))
+
+        def wrapper(*args, **kwargs):
+            self.local.stack = list(stack)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+
+    @contextmanager
+    def command(self, host, cmd):
+        """ Times a command run within a host """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.commands.append({
+                    "host": host,
+                    "command": cmd,
+                    "start": start - self.origin,
+                    "wall": duration,
+                    "thread": threading.get_ident()
+                })
+
+
+    def host_summary(self):
+        """ Summarises the command latency of each host """
+        summary = {}
+        for cmd in self.commands:
+            host = summary.setdefault(cmd["host"],
+                                      {"count": 0, "total": 0.0, "max": 0.0})
+            host["count"] += 1
+            host["total"] += cmd["wall"]
+            host["max"] = max(host["max"], cmd["wall"])
+        for host in summary.values():
+            host["mean"] = host["total"] / host["count"]
+        return summary
+
+
+    def to_json(self, path):
+        """ Writes the profile as JSON """
+        profile = {
+            "version": PROFILE_VERSION,
+            "started": self.started.isoformat(),
+            "phases": self.phases,
+            "hosts": self.host_summary(),
+            "commands": self.commands
+        }
+        with open(path, "w") as profile_file:
+            json.dump(profile, profile_file, indent=1)
+
+
+    def to_chrome_trace(self, path):
+        """ Writes the phases and commands as Chrome trace events """
+        events = []
+        for phase in self.phases:
+            events.append({
+                "name": phase["name"], "cat": "phase", "ph": "X",
+                "ts": phase["start"] * 1e6, "dur": phase["wall"] * 1e6,
+                "pid": os.getpid(), "tid": phase["thread"],
+                "args": dict(phase["details"], cpu=phase["cpu"])
+            })
+        for cmd in self.commands:
+            events.append({
+                "name": cmd["command"], "cat": "command", "ph": "X",
+                "ts": cmd["start"] * 1e6, "dur": cmd["wall"] * 1e6,
+                "pid": os.getpid(), "tid": cmd["thread"],
+                "args": {"host": cmd["host"]}
+            })
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events}, trace_file)
+
+
+    def export(self, log_dir, chrome_trace=False):
+        """ Writes the profile, and optionally the trace events, to the log
+            directory with the start time in the name """
+        stamp = self.started.strftime("%Y_%m_%d_%H_%M_%S")
+        path = os.path.join(log_dir, f"athos_profile_{stamp}.json")
+        self.to_json(path)
+        paths = [path]
+        if chrome_trace:
+            path = os.path.join(log_dir, f"athos_trace_{stamp}.json")
+            self.to_chrome_trace(path)
+            paths.append(path)
+        return paths
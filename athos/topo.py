@@ -0,0 +1,80 @@
+""" Mininet topology
+
+Builds the Mininet topology for a flattened topology config. Kept apart from
+the rest of ATHOS as it pulls in Mininet and the P4 switch, which are only
+needed once a network is actually built """
+
+from mininet.topo import Topo
+from mininet.log import info
+from athos.p4_mininet import P4Switch
+
+
+DEFAULT_P4_SWITCH = "simple_switch"
+DEFAULT_UMBRELLA_JSON = "/etc/athos/umbrella.json"
+
+
+class MyTopo(Topo):
+    """ Custom topology generator """
+
+    def __init__(self, hosts_matrix=None, switch_matrix=None,
+                 switch_dps=None, p4_switches=None,
+                 unmanaged_switches=None,
+                 sw_path=DEFAULT_P4_SWITCH,
+                 p4_json=DEFAULT_UMBRELLA_JSON,
+                 logger=None,
+                 thrift_port_base=9190):
+        """ Create a topology based on input JSON"""
+
+        # Initialize topology
+        Topo.__init__(self)
+        switch_list = []
+        self.logger = logger
+
+        for sw in switch_dps:
+            dp_id = switch_dps[sw]
+            switch_list.append(sw)
+            self.addSwitch(sw, dpid='%x' % dp_id)
+        if p4_switches:
+            info('Adding p4 switches:')
+            i = 0
+            for sw in p4_switches:
+                info(f'{sw}')
+                # Need to allow for multiple p4 switches to be used
+                # Can't use 9090 due to promethues clash
+                t_port = int(thrift_port_base) + int(i)
+                i += 1
+                self.addSwitch(sw, cls=P4Switch,
+                               sw_path=sw_path,
+                               json_path=p4_json,
+                               thrift_port=t_port
+                               )
+                switch_list.append(sw)
+        if unmanaged_switches:
+            for sw in unmanaged_switches:
+                self.addSwitch(sw, failMode="standalone")
+        for switch in switch_matrix:
+            self.addLink(switch[0], switch[2],
+                         int(switch[1]), int(switch[3]))
+        for host in hosts_matrix:
+            self.host_add(host)
+
+
+    def host_add(self, host):
+        """ Adds the host to the network """
+        hname, params = self.host_params(host)
+        self.addHost(hname, **params)
+        self.addLink(host["switch"], hname, host["swport"])
+
+
+    @staticmethod
+    def host_params(host):
+        """ Name and parameters of the host for a flattened interface.
+            Only untagged vlan interfaces get their ipv4 address here,
+            everything else starts with a placeholder that cleanup_ips
+            replaces """
+        ip = "127.0.0.1/32"
+        if "ipv4" in host and "tagged" in host and not host["tagged"]:
+            ip = host["ipv4"]
+        return f"h{host['id']}", {"ip": ip, "mac": host["mac"],
+                                  "intf": "eth-0"}
+
@@ -0,0 +1,222 @@
+""" Topology config validator
+
+Validates the whole topology config in a single pass, collecting every error
+instead of stopping at the first one. Indexes keyed by switch port, MAC and
+IP address are built along the way to detect clashes between hosts """
+
+import json
+import re
+from ipaddress import ip_address
+
+
+DEFAULT_INPUT_FILE = "/etc/athos/topology.json"
+MAC_PATTERN = re.compile(r"^[0-9a-fA-F]{2}(:[0-9a-fA-F]{2}){5}$")
+LINK_FORMAT = ("The expected link format should be: "
+               "[switchA,portA,switchB,portB] where portA is the port on "
+               "switchA connected to switchB, and vice versa for portB")
+
+
+class ConfigValidator():
+    """ Single pass validator for the topology config.
+
+        validate() returns the list of errors found, and any warnings are
+        kept in warnings. Interfaces without a MAC address are given the MAC
+        of another interface of the same host on the same switch port, as the
+        hosts are flattened into one namespace per switch port. """
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self.ports = {}
+        self.macs = {}
+        self.addresses = {"ipv4": {}, "ipv6": {}}
+
+
+    def validate(self, nw_matrix):
+        """ Validates the topology and returns the list of errors found """
+        if not isinstance(nw_matrix, dict):
+            self.errors.append("The topology should be a JSON object")
+            return self.errors
+        if "hosts_matrix" not in nw_matrix:
+            self.errors.append("No 'hosts_matrix' found")
+        else:
+            self.check_hosts(nw_matrix["hosts_matrix"])
+        if "switch_matrix" not in nw_matrix:
+            self.errors.append("No 'switch_matrix' found")
+        else:
+            self.check_switches(nw_matrix["switch_matrix"])
+        return self.errors
+
+
+    def check_hosts(self, hosts_matrix):
+        """ Validates every host and interface in one pass """
+        if not hosts_matrix:
+            self.errors.append("The hosts_matrix doesn't have any content")
+            return
+        for index, host in enumerate(hosts_matrix):
+            name = host.get("name")
+            if not name:
+                self.errors.append(f"Host entry {index} does not have a name")
+                name = f"entry {index}"
+            if not host.get("interfaces"):
+                self.errors.append(f"Host {name} does not have any interfaces")
+                continue
+            missing_macs = []
+            port_macs = {}
+            for number, iface in enumerate(host["interfaces"]):
+                where = f"Host {name} interface {number}"
+                self.check_interface(where, name, iface)
+                port = (iface.get("switch"), iface.get("swport"))
+                if "mac" in iface:
+                    port_macs.setdefault(port, iface["mac"])
+                else:
+                    missing_macs.append((where, port, iface))
+            for where, port, iface in missing_macs:
+                if port not in port_macs:
+                    self.errors.append(f"{where} does not have a MAC address")
+                    continue
+                iface["mac"] = port_macs[port]
+
+
+    def check_interface(self, where, name, iface):
+        """ Validates a single interface and indexes its port and addresses """
+        if "swport" not in iface:
+            self.errors.append(f"{where} does not have a switch port")
+        if "switch" not in iface:
+            self.errors.append(f"{where} does not have an assigned switch")
+        if "swport" in iface and "switch" in iface:
+            self.index(self.ports, (iface["switch"], iface["swport"]), name,
+                       f"{where} uses switch {iface['switch']} port "
+                       f"{iface['swport']}")
+        if "ipv4" not in iface and "ipv6" not in iface:
+            self.errors.append(f"{where} has neither an IPv4 or IPv6 address")
+        for family, version in (("ipv4", 4), ("ipv6", 6)):
+            if family in iface:
+                self.check_address(where, name, family, version, iface[family])
+        if "mac" in iface:
+            self.check_mac(where, name, iface["mac"])
+        if "vlan" in iface:
+            self.check_vlan(where, iface)
+
+
+    def check_address(self, where, name, family, version, address):
+        """ Checks that the address is a valid address with a prefix length
+            and isn't used by another host """
+        if not address or not isinstance(address, str) or "/" not in address:
+            self.errors.append(f"{where} has an invalid {family} address, "
+                               "expected an address with a prefix length: "
+                               f"{address}")
+            return
+        addr, prefix = address.split("/", 1)
+        try:
+            parsed = ip_address(addr)
+            if not prefix.isdigit() or int(prefix) > parsed.max_prefixlen:
+                raise ValueError(f"invalid prefix length /{prefix}")
+        except ValueError as err:
+            self.errors.append(f"{where} has an invalid {family} address: "
+                               f"{err}")
+            return
+        if parsed.version != version:
+            self.errors.append(f"{where} has an IPv{parsed.version} address "
+                               f"in the {family} section: {address}")
+            return
+        self.index(self.addresses[family], parsed, name,
+                   f"{where} uses {family} address {parsed}")
+
+
+    def check_mac(self, where, name, mac):
+        """ Checks that the MAC is colon separated and not used by another
+            host """
+        if not mac or not isinstance(mac, str) or not MAC_PATTERN.match(mac):
+            self.errors.append(f"{where} has an invalid MAC address. "
+                               "Currently only addresses separated with : "
+                               f"are supported: {mac}")
+            return
+        self.index(self.macs, mac.lower(), name, f"{where} uses MAC {mac}")
+
+
+    def check_vlan(self, where, iface):
+        """ Checks that the vlan id is valid and that it's stated whether the
+            vlan is tagged """
+        try:
+            vid = int(iface["vlan"])
+            if vid < 0 or vid > 4095:
+                raise ValueError
+        except (TypeError, ValueError):
+            self.errors.append(f"{where} has an invalid vlan id (vid). A valid "
+                               "vid should be between 1 and 4095. Found vid: "
+                               f"{iface['vlan']}")
+        if "tagged" not in iface:
+            self.errors.append(f"{where} has a vlan but does not state if it "
+                               "is tagged")
+
+
+    def index(self, table, key, name, msg):
+        """ Records which host uses the key, and reports keys that are used
+            by more than one host """
+        owner = table.setdefault(key, name)
+        if owner != name:
+            self.errors.append(f"{msg}, which is also used by host {owner}")
+
+
+    def check_switches(self, sw_matrix):
+        """ Validates the switch matrix """
+        if not sw_matrix:
+            self.errors.append("Switch matrix is empty")
+            return
+        if "links" not in sw_matrix:
+            self.errors.append("No links section found in the switch matrix")
+        else:
+            for link in sw_matrix["links"]:
+                self.check_link(link)
+        if "dp_ids" not in sw_matrix:
+            self.warnings.append("No dp_id section found, dp_ids generated in "
+                                 "Mininet might not match those in controller "
+                                 "config")
+            return
+        for switch, dp_id in sw_matrix["dp_ids"].items():
+            if not isinstance(dp_id, int) or isinstance(dp_id, bool) or \
+               dp_id < 0:
+                self.errors.append(f"Switch {switch} has an invalid dp_id, "
+                                   "please ensure that dp_ids are valid "
+                                   f"numbers: {dp_id}")
+
+
+    def check_link(self, link):
+        """ Checks the link format and its port numbers """
+        if not isinstance(link, list) or len(link) != 4:
+            self.errors.append(f"Invalid link found. {LINK_FORMAT}. "
+                               f"Link found: {link}")
+            return
+        for port in (link[1], link[3]):
+            try:
+                valid = 0 <= int(port) <= 255
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                self.errors.append(f"Invalid port number {port} in link "
+                                   f"{link}. Ensure that port numbers are "
+                                   "between 0 and 255")
+
+
+def validate_file(input_file):
+    """ Validates the topology in a JSON file without loading the rest of
+        ATHOS. Returns the errors and warnings found """
+    try:
+        with open(input_file) as json_file:
+            nw_matrix = json.load(json_file)
+    except (OSError, UnicodeDecodeError, ValueError) as err:
+        return [f"Unable to read {input_file}: {err}"], []
+    validator = ConfigValidator()
+    return validator.validate(nw_matrix), validator.warnings
+
+
+def validate_json(json_string):
+    """ Validates a topology given as a JSON string, the same way as
+        validate_file. Returns the errors and warnings found """
+    try:
+        nw_matrix = json.loads(json_string)
+    except ValueError as err:
+        return [f"Unable to parse the JSON topology: {err}"], []
+    validator = ConfigValidator()
+    return validator.validate(nw_matrix), validator.warnings
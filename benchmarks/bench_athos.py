@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+
+""" ATHOS overhead benchmarks
+
+Generates synthetic IXP topologies and times the parts of ATHOS that don't
+need a real network: parsing and validating the config, flattening it, building
+the ip commands for cleanup_ips and scheduling the ping sweeps. Mininet is
+replaced by a stub node layer, so this can run without root or Mininet being
+installed.
+
+Usage:
+    python3 benchmarks/bench_athos.py -o results.json
+    python3 benchmarks/bench_athos.py -o new.json --compare results.json
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+
+DEFAULT_SIZES = "10,100,1000"
+DEFAULT_REPEAT = 5
+MAX_SCHEDULED_PAIRS = 20000 # Pairs pushed through the stub probe scheduler
+
+
+def stub_mininet():
+    """ Registers placeholder mininet modules when mininet isn't installed, so
+        that athos can be imported. Logging from athos is discarded """
+    try:
+        import mininet.net  # pylint: disable=import-outside-toplevel,unused-import
+        return
+    except ImportError:
+        pass
+
+    def discard(*_args, **_kwargs):
+        pass
+
+    class Placeholder():
+        def __init__(self, *_args, **_kwargs):
+            pass
+
+    modules = {
+        "mininet": {},
+        "mininet.log": {
+            "info": discard, "error": discard, "warn": discard,
+            "output": discard, "debug": discard, "setLogLevel": discard,
+            "lg": logging.getLogger("mininet"),
+            "StreamHandlerNoNewline": logging.StreamHandler},
+        "mininet.topo": {"Topo": Placeholder},
+        "mininet.net": {"Mininet": Placeholder},
+        "mininet.node": {"RemoteController": Placeholder,
+                         "Switch": Placeholder, "Host": Placeholder},
+        "mininet.cli": {"CLI": Placeholder},
+        "mininet.moduledeps": {"pathCheck": discard}
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+
+
+class StubProcess():
+    """ Stands in for a ping process that got all of its replies """
+
+    def __init__(self, args):
+        self.count = next(arg[2:] for arg in args if arg.startswith("-c"))
+
+    def communicate(self):
+        return (f"{self.count} packets transmitted, {self.count} received, "
+                "0% packet loss\n", None)
+
+
+class StubNode():
+    """ Host node that records the commands run within it """
+
+    def __init__(self, name):
+        self.name = name
+        self.pid = 0
+        self.cmds = 0
+
+    def IP(self):
+        return "127.0.0.1"
+
+    def cmd(self, *_args, **_kwargs):
+        self.cmds += 1
+        return ""
+
+    def popen(self, args, **_kwargs):
+        self.cmds += 1
+        return StubProcess(args)
+
+
+class StubNet():
+    """ Network that creates stub nodes on demand """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def getNodeByName(self, name):
+        if name not in self.nodes:
+            self.nodes[name] = StubNode(name)
+        return self.nodes[name]
+
+    @staticmethod
+    def _parsePing(ping_output):
+        match = re.search(r"(\d+) packets transmitted, (\d+)( packets)? "
+                          "received", ping_output)
+        if not match:
+            return 1, 0
+        return int(match.group(1)), int(match.group(2))
+
+
+def generate_topology(members, switches, vlans, tagged_ratio=0.3, seed=0):
+    """ Generates a topology.json style dict for an IXP with the given number
+        of members, switches and vlans. Switches are connected in a ring with
+        extra chords, and members get one or two ports with some of them
+        carrying several tagged vlans """
+    rng = random.Random(seed)
+    names = [f"s{i + 1}" for i in range(switches)]
+    links = []
+    ports = {switch: 100 for switch in names}
+
+    def add_link(src, dst):
+        links.append([src, str(ports[src]), dst, str(ports[dst])])
+        ports[src] += 1
+        ports[dst] += 1
+
+    for i, switch in enumerate(names):
+        add_link(switch, names[(i + 1) % switches])
+    for i in range(0, switches, 3):
+        add_link(names[i], names[(i + switches // 2) % switches])
+
+    swports = {switch: 1 for switch in names}
+    hosts = []
+    addr = 0
+    for member in range(members):
+        interfaces = []
+        for _ in range(rng.choice((1, 1, 2))):
+            switch = rng.choice(names)
+            swport = swports[switch]
+            swports[switch] += 1
+            tagged = rng.random() < tagged_ratio
+            for vlan in rng.sample(range(vlans), rng.randint(1, vlans)
+                                   if tagged else 1):
+                addr += 1
+                interfaces.append({
+                    "switch": switch,
+                    "swport": swport,
+                    "mac": "02:00:00:{:02x}:{:02x}:{:02x}".format(
+                        addr >> 16 & 0xff, addr >> 8 & 0xff, addr & 0xff),
+                    "ipv4": f"10.{vlan}.{addr >> 8 & 0xff}.{addr & 0xff}/16",
+                    "ipv6": f"2001:db8:{vlan}::{addr:x}/64",
+                    "vlan": 100 + vlan,
+                    "tagged": tagged
+                })
+        hosts.append({"name": f"AS{64512 + member}", "interfaces": interfaces})
+    return {
+        "hosts_matrix": hosts,
+        "switch_matrix": {
+            "dp_ids": {switch: i + 1 for i, switch in enumerate(names)},
+            "links": links
+        }
+    }
+
+
+def time_it(func, repeat):
+    """ Runs the function repeat times, returning the timings in seconds """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def benchmark_size(members, repeat):
+    """ Times each stage of ATHOS for a synthetic topology """
+    from athos.athos import ATHOS  # pylint: disable=import-outside-toplevel
+    from athos.prober import ProbeResult  # pylint: disable=import-outside-toplevel
+    from athos.reachability import ReachabilityStore  # pylint: disable=import-outside-toplevel
+    from athos.scenarios import FailurePlanner  # pylint: disable=import-outside-toplevel
+
+    switches = max(3, members // 25)
+    vlans = max(2, members // 200)
+    topology = generate_topology(members, switches, vlans)
+
+    def new_athos():
+        athos = ATHOS()
+        athos.logger = logging.getLogger("athos.bench")
+        athos.net = StubNet()
+        return athos
+
+    def parse():
+        new_athos().parse_config(copy.deepcopy(topology))
+
+    def flatten():
+        new_athos().flatten_nw_matrix(copy.deepcopy(topology))
+
+    parsed = new_athos()
+    parsed.parse_config(copy.deepcopy(topology))
+
+    def cleanup_commands():
+        athos = new_athos()
+        athos.hosts_matrix = parsed.hosts_matrix
+        athos.vlan_to_host_id = parsed.vlan_to_host_id
+        athos.ip_config_batches()
+
+    parsed.ip_config_batches()
+    parsed.graph = parsed.build_graph()
+
+    def sweep_plan():
+        for family in ("ipv4", "ipv6"):
+            parsed.sweep_plan(family)
+
+    def sampled_plan():
+        for family in ("ipv4", "ipv6"):
+            parsed.samples = {}
+            parsed.sweep_plan(family, sample=parsed.sample_plan(family))
+
+    def crossing_pairs():
+        for link in parsed.graph.links:
+            parsed.graph.distance_cache = {}
+            parsed.crossing_pairs(link)
+
+    def failure_scenarios():
+        planner = FailurePlanner(parsed.graph, parsed.vlan_switches())
+        planner.link_scenarios(2)
+        planner.switch_scenarios(parsed.switch_dps)
+
+    scheduled = [(host, dst) for _, sources in parsed.sweep_plan("ipv4")
+                 for host, dsts in sources
+                 for dst in dsts][:MAX_SCHEDULED_PAIRS]
+
+    def sweep_schedule():
+        parsed.run_probes(scheduled, "ipv4")
+
+    reachability = ReachabilityStore()
+    v4_plan = parsed.sweep_plan("ipv4")
+    v4_members = {vlan: [host["id"] for host in members if "ipv4" in host]
+                  for vlan, members in parsed.vlan_matrix.items()}
+    v4_results = [ProbeResult(1, 1, [])] * sum(
+        len(dsts) for _, sources in v4_plan for _, dsts in sources)
+    reachability.record("ipv4", v4_plan, v4_results, v4_members)
+    reachability.begin("link down")
+    v4_results[::97] = [ProbeResult(1, 0, [])] * len(v4_results[::97])
+    reachability.record("ipv4", v4_plan, v4_results, v4_members)
+
+    def reachability_diff():
+        reachability.diff("baseline", "link down")
+
+    benches = {
+        "parse_config": parse,
+        "flatten_nw_matrix": flatten,
+        "cleanup_ips_commands": cleanup_commands,
+        "sweep_plan": sweep_plan,
+        "sampled_plan": sampled_plan,
+        "crossing_pairs": crossing_pairs,
+        "failure_scenarios": failure_scenarios,
+        "sweep_schedule": sweep_schedule,
+        "reachability_diff": reachability_diff
+    }
+    pairs = sum(len(dsts) for family in ("ipv4", "ipv6")
+                for _, sources in parsed.sweep_plan(family)
+                for _, dsts in sources)
+    sampled = sum(len(dsts) for family in ("ipv4", "ipv6")
+                  for _, sources in parsed.sweep_plan(
+                      family, sample=parsed.sample_plan(family))
+                  for _, dsts in sources)
+    results = {
+        "members": members,
+        "switches": switches,
+        "vlans": vlans,
+        "interfaces": len(parsed.hosts_matrix) + len(parsed.vlan_to_host_id),
+        "pairs": pairs,
+        "sampled_pairs": sampled,
+        "scheduled_pairs": len(scheduled),
+        "timings": {}
+    }
+    for name, func in benches.items():
+        timings = time_it(func, repeat)
+        results["timings"][name] = {
+            "min": min(timings),
+            "median": statistics.median(timings),
+            "runs": len(timings)
+        }
+    return results
+
+
+def git_commit():
+    """ Returns the commit being benchmarked, if known """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """ Prints the change in median time of each benchmark against a previous
+        set of results """
+    old_sizes = {str(size["members"]): size for size in baseline["sizes"]}
+    print(f"Comparing {results['commit']} against {baseline['commit']}")
+    for size in results["sizes"]:
+        old = old_sizes.get(str(size["members"]))
+        if not old:
+            continue
+        for name, timing in size["timings"].items():
+            if name not in old["timings"]:
+                continue
+            before = old["timings"][name]["median"]
+            after = timing["median"]
+            ratio = after / before if before else float("inf")
+            print(f"{size['members']:>6} {name:<22} {before * 1000:10.2f}ms "
+                  f"-> {after * 1000:10.2f}ms  x{ratio:.2f}")
+
+
+def parse_args(sys_args):
+    """ Parse arguments for the benchmarks """
+    args = argparse.ArgumentParser(
+        prog='bench_athos',
+        description='Benchmarks ATHOS against synthetic topologies'
+    )
+    args.add_argument(
+        '-s', '--sizes',
+        action='store',
+        help='Comma separated number of members for each topology',
+        default=DEFAULT_SIZES
+    )
+    args.add_argument(
+        '-r', '--repeat',
+        action='store',
+        type=int,
+        help='Number of times each benchmark is run',
+        default=DEFAULT_REPEAT
+    )
+    args.add_argument(
+        '-o', '--output',
+        action='store',
+        help='Writes the results as JSON to this file'
+    )
+    args.add_argument(
+        '--compare',
+        action='store',
+        help='Compares the results with a previous results file'
+    )
+    return args.parse_args(sys_args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    stub_mininet()
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sizes": []
+    }
+    for members in (int(size) for size in args.sizes.split(",")):
+        size = benchmark_size(members, args.repeat)
+        results["sizes"].append(size)
+        for name, timing in size["timings"].items():
+            print(f"{members:>6} {name:<22} {timing['median'] * 1000:10.2f}ms")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=1)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
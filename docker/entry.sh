@@ -1,5 +1,6 @@
 #!/bin/bash
 OUT_FILE=/athos/ixpman_files/output.txt
+EVENTS_FILE=/athos/ixpman_files/events.ndjson
 
 service openvswitch-switch start 2>&1 | tee $OUT_FILE
 ovs-vsctl set-manager ptcp:6640 2>&1 | tee -a $OUT_FILE
@@ -11,10 +12,12 @@ else
 fi
 # Need to wait a second to give the SDN controller a chance to start up
 sleep 1s
-athos 2>&1 | tee -a $OUT_FILE
+athos --events $EVENTS_FILE 2>&1 | tee -a $OUT_FILE
 
 cd ixpman_files
-python3 parser.py 2>&1 | tee -a $OUT_FILE
+python3 parser.py $EVENTS_FILE 2>&1 | tee -a $OUT_FILE
 NOW=`date +%Y_%m_%d_%H_%M_%S`
 mkdir -p logs
 cp output.txt logs/output_$NOW.log
+cp events.ndjson logs/events_$NOW.ndjson
+python3 history.py index
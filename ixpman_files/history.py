@@ -0,0 +1,375 @@
+#!/usr/bin/python3
+
+""" Athos run history
+
+    Indexes the runs archived in ixpman_files/logs into a SQLite database, so
+    that trends across runs can be queried without parsing the archives again.
+    Runs archived with an event stream (events_<timestamp>.ndjson) are indexed
+    from it, older runs fall back to their console output
+    (output_<timestamp>.log), which only gives the lossy sources and totals.
+
+    Only new or changed archives are read when indexing again. Pairs that
+    didn't lose any packets aren't stored one by one, only in the totals of
+    each run, which keeps the index small for large topologies. Losses of
+    pairs that got every reply when retried are marked as transient.
+
+    python3 history.py index
+    python3 history.py flaps --limit 10
+    python3 history.py sweeps
+    python3 history.py runs """
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from athos.events import read_events
+
+
+DEFAULT_LOG_DIR = "logs"
+DEFAULT_DATABASE = "history.db"
+ARCHIVE_PATTERN = re.compile(
+    r"^(events|output)_(\d{4}_\d{2}_\d{2}_\d{2}_\d{2}_\d{2})\.(ndjson|log)$")
+STAMP_FORMAT = "%Y_%m_%d_%H_%M_%S"
+RESULTS_PATTERN = re.compile(r"\*\*\* Results: .*\((\d+)/(\d+) received\)")
+LINK_PATTERN = re.compile(r"Setting link between (\S+) and (\S+) (down|up)")
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime REAL, stamp TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, stamp TEXT UNIQUE, source TEXT, started REAL,
+    ended REAL, passed INTEGER, digest TEXT, members INTEGER,
+    sent INTEGER DEFAULT 0, received INTEGER DEFAULT 0, sweep_time REAL);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER, name TEXT, wall REAL, details TEXT);
+CREATE TABLE IF NOT EXISTS losses (
+    run_id INTEGER, phase TEXT, family TEXT, vlan TEXT, src TEXT, dst TEXT,
+    sent INTEGER, received INTEGER, transient INTEGER);
+CREATE INDEX IF NOT EXISTS losses_run ON losses (run_id);
+CREATE INDEX IF NOT EXISTS losses_src ON losses (src);
+CREATE INDEX IF NOT EXISTS losses_dst ON losses (dst);
+CREATE INDEX IF NOT EXISTS phases_run ON phases (run_id);
+"""
+
+class History():
+    """ SQLite index of the archived Athos runs
+
+        Each run is indexed in a single transaction, so an interrupted index
+        never leaves half a run behind. A run whose archive has changed since
+        it was indexed, such as one copied while still being written, is
+        indexed again from scratch. """
+
+    def __init__(self, log_dir=DEFAULT_LOG_DIR, database=None):
+        self.log_dir = log_dir
+        self.db = sqlite3.connect(database or
+                                  os.path.join(log_dir, DEFAULT_DATABASE))
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in
+                   self.db.execute("PRAGMA table_info(losses)")]
+        if "transient" not in columns:
+            # Indexes created before retries were recorded
+            self.db.execute("ALTER TABLE losses ADD COLUMN transient INTEGER")
+
+
+    def archives(self):
+        """ Finds the archive to index for each run, preferring the event
+            stream over the console output. Returns (stamp, path) tuples in
+            the order the runs happened """
+        runs = {}
+        for name in os.listdir(self.log_dir):
+            match = ARCHIVE_PATTERN.match(name)
+            if not match:
+                continue
+            kind, stamp = match.group(1), match.group(2)
+            if kind == "events" or stamp not in runs:
+                runs[stamp] = os.path.join(self.log_dir, name)
+        return sorted(runs.items())
+
+
+    def index(self):
+        """ Indexes the archives that are new or have changed. Returns the
+            amount of runs indexed """
+        indexed = 0
+        for stamp, path in self.archives():
+            stat = os.stat(path)
+            known = self.db.execute(
+                "SELECT size, mtime FROM files WHERE path = ?",
+                (path,)).fetchone()
+            if known == (stat.st_size, stat.st_mtime):
+                continue
+            with self.db:
+                self.forget(stamp)
+                if path.endswith(".ndjson"):
+                    self.index_events(stamp, path)
+                else:
+                    self.index_output(stamp, path)
+                self.db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime, stamp))
+            indexed += 1
+        return indexed
+
+
+    def forget(self, stamp):
+        """ Removes a run from the index """
+        row = self.db.execute("SELECT id FROM runs WHERE stamp = ?",
+                              (stamp,)).fetchone()
+        if row:
+            for table in ("phases", "losses"):
+                self.db.execute(f"DELETE FROM {table} WHERE run_id = ?", row)
+            self.db.execute("DELETE FROM runs WHERE id = ?", row)
+        self.db.execute("DELETE FROM files WHERE stamp = ?", (stamp,))
+
+
+    def new_run(self, stamp, source):
+        """ Adds a run, returning its id """
+        started = datetime.strptime(stamp, STAMP_FORMAT).timestamp()
+        return self.db.execute(
+            "INSERT INTO runs (stamp, source, started) VALUES (?, ?, ?)",
+            (stamp, source, started)).lastrowid
+
+
+    def index_events(self, stamp, path):
+        """ Indexes a run from its event stream """
+        run_id = self.new_run(stamp, "events")
+        run = {"sent": 0, "received": 0, "sweep_time": 0.0}
+        phases = []
+        for event in read_events(path):
+            kind = event["event"]
+            if kind == "run_start":
+                run["started"] = event["ts"]
+            elif kind == "topology":
+                run["digest"] = event.get("digest")
+                run["members"] = event.get("members")
+            elif kind == "phase_start":
+                phases.append(self.phase_label(event))
+            elif kind == "phase_end":
+                label = self.phase_label(event)
+                if label in phases:
+                    phases.remove(label)
+                details = {key: value for key, value in event.items()
+                           if key not in ("ts", "event", "phase", "wall")}
+                self.db.execute(
+                    "INSERT INTO phases VALUES (?, ?, ?, ?)",
+                    (run_id, event["phase"], event["wall"],
+                     json.dumps(details) if details else None))
+                if event["phase"].startswith("sweep "):
+                    run["sweep_time"] += event["wall"]
+            elif kind == "pair":
+                run["sent"] += event["sent"]
+                run["received"] += event["received"]
+                if event["received"] < event["sent"]:
+                    phase = next((label for label in reversed(phases)
+                                  if not label.startswith("sweep ")), None)
+                    transient = event.get("transient")
+                    self.db.execute(
+                        "INSERT INTO losses VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (run_id, phase, event["family"], event["vlan"],
+                         event["src"], event["dst"], event["sent"],
+                         event["received"],
+                         None if transient is None else int(transient)))
+            elif kind == "run_end":
+                run["passed"] = int(event["passed"])
+                run["ended"] = event["ts"]
+        self.update_run(run_id, run)
+
+
+    def index_output(self, stamp, path):
+        """ Indexes a run from its console output. The destinations that
+            couldn't be reached aren't named in the output, so only the
+            sources of the losses are stored """
+        run_id = self.new_run(stamp, "output")
+        run = {"sent": 0, "received": 0, "sweep_time": None}
+        family = vlan = None
+        phase = "baseline"
+        failed = False
+        with open(path, errors="replace") as output:
+            for line in output:
+                line = line.rstrip()
+                if line.startswith("*** Ping: testing ping4"):
+                    family = "ipv4"
+                elif line.startswith("*** Ping: testing ping6"):
+                    family = "ipv6"
+                elif line.startswith("Testing reachability for hosts with "
+                                     "vlan: "):
+                    vlan = line.split(": ", 1)[1]
+                elif LINK_PATTERN.match(line):
+                    src, dst, status = LINK_PATTERN.match(line).groups()
+                    phase = f"link {status} {src}-{dst}"
+                elif RESULTS_PATTERN.match(line):
+                    received, sent = RESULTS_PATTERN.match(line).groups()
+                    run["sent"] += int(sent)
+                    run["received"] += int(received)
+                elif line.startswith("FAIL:"):
+                    failed = True
+                elif line.startswith("*** Stopping"):
+                    run["passed"] = int(not failed)
+                elif " -> " in line and family:
+                    src, dsts = line.split(" -> ", 1)
+                    dsts = dsts.split()
+                    lost = dsts.count("X")
+                    if lost:
+                        self.db.execute(
+                            "INSERT INTO losses VALUES "
+                            "(?, ?, ?, ?, ?, NULL, ?, ?, NULL)",
+                            (run_id, phase, family, vlan, src, len(dsts),
+                             len(dsts) - lost))
+        if failed:
+            run["passed"] = 0
+        self.update_run(run_id, run)
+
+
+    def update_run(self, run_id, run):
+        """ Stores the totals of a run """
+        fields = sorted(run)
+        self.db.execute(
+            f"UPDATE runs SET {', '.join(f'{field} = ?' for field in fields)}"
+            " WHERE id = ?", [run[field] for field in fields] + [run_id])
+
+
+    @staticmethod
+    def phase_label(event):
+        """ Names a phase along with the link or scenario it was for """
+        if "src" in event and "dst" in event:
+            return f"{event['phase']} {event['src']}-{event['dst']}"
+        if "scenario" in event:
+            return f"{event['phase']} {event['scenario']}"
+        return event["phase"]
+
+
+    def flaps(self, limit=10):
+        """ Members that lost packets in the most runs. Returns (member, runs
+            with losses, packets lost, losses that were transient) tuples
+            along with the amount of runs indexed """
+        total = self.db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+        rows = self.db.execute("""
+            SELECT member, COUNT(DISTINCT run_id) AS runs,
+                   SUM(sent - received) AS lost,
+                   COUNT(CASE WHEN transient = 1 THEN 1 END) AS transient
+            FROM (SELECT run_id, src AS member, sent, received, transient
+                  FROM losses
+                  UNION ALL
+                  SELECT run_id, dst, sent, received, transient FROM losses
+                  WHERE dst IS NOT NULL)
+            GROUP BY member ORDER BY runs DESC, lost DESC LIMIT ?""",
+                               (limit,)).fetchall()
+        return rows, total
+
+
+    def sweeps(self):
+        """ Sweep time of each run along with its topology digest, in the
+            order the runs happened """
+        return self.db.execute("""
+            SELECT stamp, digest, sweep_time FROM runs
+            WHERE sweep_time IS NOT NULL ORDER BY started""").fetchall()
+
+
+    def runs(self, limit=20):
+        """ The most recent runs """
+        return self.db.execute("""
+            SELECT stamp, source, passed, sent, received, sweep_time
+            FROM runs ORDER BY started DESC LIMIT ?""", (limit,)).fetchall()
+
+
+def report_flaps(history, limit):
+    """ Lists the members that lost packets in the most runs """
+    rows, total = history.flaps(limit)
+    if not rows:
+        print(f"No members lost packets in the {total} runs indexed")
+    for member, runs, lost, transient in rows:
+        flaky = f", {transient} recovered on a retry" if transient else ""
+        print(f"{member} lost packets in {runs} of {total} runs "
+              f"({lost} packets{flaky})")
+
+
+def report_sweeps(history):
+    """ Compares the sweep time of the runs since the last config change
+        with the runs before it """
+    rows = [row for row in history.sweeps() if row[1]]
+    if not rows:
+        print("No runs with sweep timings have been indexed")
+        return
+    for stamp, digest, sweep_time in rows:
+        print(f"{stamp}  {digest[:12]}  {sweep_time:.3f}s")
+    changes = [i for i in range(1, len(rows)) if rows[i][1] != rows[i - 1][1]]
+    if not changes:
+        print("The config has not changed over the runs indexed")
+        return
+    change = changes[-1]
+    before = [row[2] for row in rows[:change] if row[1] == rows[change - 1][1]]
+    after = [row[2] for row in rows[change:]]
+    mean_before = sum(before) / len(before)
+    mean_after = sum(after) / len(after)
+    growth = 100.0 * (mean_after - mean_before) / mean_before \
+        if mean_before else 0.0
+    print(f"Config changed at {rows[change][0]}: mean sweep time went from "
+          f"{mean_before:.3f}s over {len(before)} runs to {mean_after:.3f}s "
+          f"over {len(after)} runs ({growth:+.1f}%)")
+
+
+def report_runs(history):
+    """ Lists the most recent runs and their results """
+    for stamp, source, passed, sent, received, sweep_time in history.runs():
+        result = {1: "passed", 0: "failed"}.get(passed, "unfinished")
+        loss = f"{100.0 * (sent - received) / sent:.2f}%" if sent else "-"
+        timing = f"{sweep_time:.3f}s" if sweep_time is not None else "-"
+        print(f"{stamp}  {result:10}  loss {loss:>7}  sweeps {timing:>9}  "
+              f"({source})")
+
+
+def parse_args(sys_args):
+    """ Parse arguments for the history tool """
+    args = argparse.ArgumentParser(
+        prog='history',
+        description='Indexes and queries the history of archived Athos runs'
+    )
+    args.add_argument(
+        'query',
+        nargs='?',
+        choices=['index', 'flaps', 'sweeps', 'runs'],
+        default='index',
+        help='Indexes new runs, then answers the query'
+    )
+    args.add_argument(
+        '--log-dir',
+        action='store',
+        help='Directory with the archived runs',
+        default=DEFAULT_LOG_DIR
+    )
+    args.add_argument(
+        '--database',
+        action='store',
+        help='SQLite database holding the index, kept in the log directory by '
+             'default'
+    )
+    args.add_argument(
+        '--limit',
+        action='store',
+        type=int,
+        help='Amount of members listed by the flaps query',
+        default=10
+    )
+    return args.parse_args(sys_args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if not os.path.isdir(args.log_dir):
+        print(f"Error: Log directory {args.log_dir} was not found")
+        sys.exit(1)
+    history = History(args.log_dir, args.database)
+    indexed = history.index()
+    if args.query == "index":
+        print(f"Indexed {indexed} new runs")
+    elif args.query == "flaps":
+        report_flaps(history, args.limit)
+    elif args.query == "sweeps":
+        report_sweeps(history)
+    else:
+        report_runs(history)
+
+if __name__ == "__main__":
+    main()
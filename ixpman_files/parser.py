@@ -2,27 +2,41 @@
 
 """ Athos output parser
 
-    Parses the output from Athos and validates that the testing was performed
-    successfully """
+    Parses the event stream written by Athos with --events and validates that
+    the testing was performed successfully """
 
 import sys
+from athos.events import read_events
 
 class Parser():
     """ Athos output parser
-    
+
         Parsers the results from the mininet tests performed by Athos. It will
         then report whether the tests was performed successfully, and highlights
-        any hosts that might have a problem """
+        any hosts that might have a problem. The events are read one at a time,
+        so only the totals and the links currently down are kept in memory """
 
-    def __init__(self):
-        self.raw_file = None
-        self.raw_file_location = "output.txt"
+    def __init__(self, events_file="events.ndjson"):
+        self.events_file_location = events_file
         self.packets_sent = 0
         self.packets_received = 0
+        self.packets_transient = 0
+        self.transient_pairs = 0
+        self.links_down = []
+        self.phases = []
+        self.verdicts_failed = 0
+        self.run_passed = None
+        self.handlers = {
+            "phase_start": self.phase_start,
+            "phase_end": self.phase_end,
+            "link": self.link,
+            "pair": self.pair,
+            "verdict": self.verdict,
+            "run_end": self.run_end
+        }
 
     def start(self):
-        self.raw_file = self.open_file(self.raw_file_location)
-        self.find_results()
+        self.find_results(self.open_file(self.events_file_location))
 
         if self.packets_sent == 0:
             print("Failure: Please check logs as no packets were sent")
@@ -30,114 +44,138 @@ class Parser():
         if self.packets_received == 0:
             print("Failure: Please check logs as no packets were received")
             sys.exit()
-        ploss = self.calc_packet_loss(self.packets_sent, 
-                                      self.packets_received, False)
-        # Allow for mininet bootup problems
-        if ploss == 0 or ploss < 1:
-            print("Success with no packet loss")
-            sys.exit()
-        if ploss > 1 and ploss < 5:
-            print("Success with minimal packet loss. Less than 5%")
-            sys.exit()
-        if ploss > 1:
-            print("Failure please check configs")
-            print(f"Packets sent: {self.packets_sent}")
-            print(f"Packets received: {self.packets_received}")
-            sys.exit()
+        if self.transient_pairs:
+            print(f"{self.transient_pairs} pairs lost packets transiently but "
+                  "got every reply when retried")
+        if self.run_passed is None:
+            print("Warning: Athos did not finish testing, the results are "
+                  "incomplete")
+        # Pairs that recovered on a retry aren't counted as lost, the same as
+        # the threshold check within Athos
+        ploss = self.calc_packet_loss(
+            self.packets_sent, self.packets_received + self.packets_transient,
+            False)
         if ploss < 0:
             print("Failure more packets received than sent")
             print(f"Packets sent: {self.packets_sent}")
             print(f"Packets received: {self.packets_received}")
             sys.exit()
+        # Allow for mininet bootup problems
+        if ploss < 1 and not self.verdicts_failed:
+            print("Success with no packet loss")
+            sys.exit()
+        if ploss < 5 and not self.verdicts_failed:
+            print("Success with minimal packet loss. Less than 5%")
+            sys.exit()
+        print("Failure please check configs")
+        print(f"Packets sent: {self.packets_sent}")
+        print(f"Packets received: {self.packets_received}")
+        sys.exit()
 
 
     def open_file(self, input_file):
-        """ Parses the output file  """
-        data = None
+        """ Opens the event stream, returning a generator over its events """
         try:
-            with open(input_file) as f:
-                data = [line.rstrip() for line in f]
-        except (UnicodeDecodeError, PermissionError, ValueError):
-            print(f"Error: Error within the the file{input_file}. Athos "\
-                +" might not have finished correctly")
+            with open(input_file):
+                pass
+        except (PermissionError, IsADirectoryError):
+            print(f"Error: Unable to read {input_file}. Athos might not have "
+                  "finished correctly")
             sys.exit()
-        except (FileNotFoundError):
-            print(f"Error: File {input_file} was not found. Please check that" +
-                "athos ran succesfully and it's output was piped into " +
-                f"{input_file}")
+        except FileNotFoundError:
+            print(f"Error: File {input_file} was not found. Please check that "
+                  "athos ran succesfully with --events writing to "
+                  f"{input_file}")
             sys.exit()
+        return read_events(input_file)
 
-        return data
-
-    def find_results(self):
-        last_ping_set = []
-        add_to_set = False
-        ping_str = "*** Ping"
-        results_str = "*** Results"
-        stop_str = "*** Stopping"
-        for line in self.raw_file:
-            if line[:12] == stop_str:
-                break
-            if add_to_set:
-                last_ping_set.append(line)
-                if line[:11] == results_str:
-                    r, s, ploss = self.get_packet_stats(line)
-                    self.packets_sent+=s
-                    self.packets_received+=r
-                    if ploss > 5:
-                        print("packet loss detected in ping set:")
-                        print(last_ping_set)
-                        self.process_loss(last_ping_set)
-                    if ploss > 0:
-                        print("Well this isn't right, you have received more" +
-                              " packets than was sent. \nLast ping set:")
-                        print(last_ping_set)
-                    last_ping_set = []
-                    continue
-                continue
-            if line[:8] == ping_str:
-                add_to_set = True
-                last_ping_set.append(line)
-                continue
-
-    
-    def get_packet_stats(self, line):
-        """ Retrieves the amount of packets sent and received """
-        r, s = line.split("(")[1].split(" ")[0].split("/")
-        ploss = self.calc_packet_loss(int(s), int(r))
-        return int(s), int(r), int(ploss)
+    def find_results(self, events):
+        """ Goes through the events, totalling the packets and reporting
+            any pairs that lost packets as they are found """
+        try:
+            for event in events:
+                handler = self.handlers.get(event["event"])
+                if handler:
+                    handler(event)
+        except UnicodeDecodeError:
+            print(f"Error: Error within the file {self.events_file_location}. "
+                  "Athos might not have finished correctly")
+            sys.exit()
+
+
+    def phase_start(self, event):
+        self.phases.append(event["phase"])
+
+
+    def phase_end(self, event):
+        if event["phase"] in self.phases:
+            self.phases.remove(event["phase"])
+
+
+    def link(self, event):
+        """ Keeps track of the links that are currently down """
+        link = f"{event['src']}-{event['dst']}"
+        if event["status"] == "down":
+            self.links_down.append(link)
+        elif link in self.links_down:
+            self.links_down.remove(link)
+
+
+    def pair(self, event):
+        """ Adds the packets of a pair to the totals, and reports the pair if
+            it lost any. Pairs that recovered on a retry are reported as
+            flaky rather than failed """
+        self.packets_sent += event["sent"]
+        self.packets_received += event["received"]
+        if event["received"] >= event["sent"]:
+            return
+        if event.get("transient"):
+            self.packets_transient += event["sent"] - event["received"]
+            self.transient_pairs += 1
+            print(f"Transient loss: {event['src']} ({event['src_host']}) -> "
+                  f"{event['dst']} ({event['dst_host']}) over "
+                  f"{event['family']} in vlan {event['vlan']}, "
+                  f"{event['received']}/{event['sent']} received before "
+                  "getting every reply on a retry")
+            return
+        self.process_loss(event)
+
+
+    def verdict(self, event):
+        if not event["passed"]:
+            self.verdicts_failed += 1
+            print(f"Athos found too much packet loss {event['context']}. "
+                  f"IPv4 loss: {event['ipv4']} IPv6 loss: {event['ipv6']}")
+
+
+    def run_end(self, event):
+        self.run_passed = event["passed"]
 
 
     def calc_packet_loss(self, sent, received, to_int=True):
-        lost = received - sent
+        lost = sent - received
         ploss = 100.0 * lost/sent
-        if to_int: 
+        if to_int:
             return int(ploss)
         else:
             return ploss
 
 
-    def process_loss(self, last_ping_set):
-        problem_printed = False
-        ping_str = "*** Ping"
-        for line in last_ping_set:
-            if not problem_printed:
-                if line[:3] == "Set":
-                    print("Packet loss possible due to misconfigured switches")
-                    print("Packet loss when:")
-                    print(line)
-                    problem_printed = True
-                    continue
-                if line[:8] == ping_str:
-                    print("Problem occurring without setting any " +
-                          "links up or down")
-                    problem_printed = True
-            hosts = line.split(" ")
-            for h in hosts[2:]:
-                if h == 'x':
-                    print(f"Problem occurring when {hosts[:1]} is pinging")
-                    print(f"Please validate links that {hosts[:1]} is using")
-                    break
+    def process_loss(self, event):
+        """ Reports a pair that lost packets, along with what was going on
+            in the network at the time """
+        if self.links_down:
+            print("Packet loss possible due to misconfigured switches")
+            print(f"Packet loss when {', '.join(self.links_down)} "
+                  "were set down:")
+        else:
+            print(f"Problem occurring during {' > '.join(self.phases)} "
+                  "without any links being down:")
+        print(f"{event['src']} ({event['src_host']}) could not reach "
+              f"{event['dst']} ({event['dst_host']}) over {event['family']} "
+              f"in vlan {event['vlan']}, {event['received']}/{event['sent']} "
+              "received")
+        print(f"Please validate links that {event['src_host']} is using")
 
 if __name__ == "__main__":
-    Parser().start()
\ No newline at end of file
+    Parser(*sys.argv[1:2]).start()